@@ -0,0 +1,413 @@
+"""
+Batch position analysis (hint overlays, post-game review).
+
+    from analysis import analyze
+    results = analyze([{**state, "reset_on_tie": False},
+                       {"moves": [[4, 4], [4, 0]], "players": 2, "reset_on_tie": False}])
+
+A position is one of:
+  - {"board": <board dict>, "turn": "O", "players": 3, "reset_on_tie": False}
+    where the board dict is UltimateBoard.serialize() output. A "state"
+    message works as it is plus "reset_on_tie" (its "required_players" is the
+    player count).
+  - {"moves": [[big, small], ...], "players": 2, "reset_on_tie": False,
+     "win_rule": ..., "side": ..., "depth": ...} (replayed from an empty board)
+
+Whose turn it is, how many play and what happens to tied boards can't be read
+off a board (tied boards get wiped, forfeits and clock skips pass turns), so
+they must be given; a bare board dict is rejected.
+
+For each one you get the legal moves, the macro status under the position's
+win_rule, and a depth-limited alpha-beta evaluation with a best move.
+
+Results are cached (LRU) under a canonical key: the position is mapped through
+all 8 symmetries of the square (applied at every board level at once) and the
+smallest encoding wins, so mirrored/rotated positions share one entry. Cache
+misses are spread over a process pool; answers are mapped back into the
+caller's orientation.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from common import (MARK_OF, TIE, BoardConfig, UltimateBoard, get_config,
+                    mark_id, small_table)
+
+WIN_SCORE = 100000
+BOARD_SCORE = 100
+THREAT_SCORE = 8
+
+DEFAULT_DEPTH = 3
+DEFAULT_NODES = 20000  # per position, across all iterative-deepening passes
+# below this many cache misses, searching inline beats starting/feeding the pool
+POOL_THRESHOLD = 4
+
+
+# -----------------------------------------------------
+# symmetries
+# -----------------------------------------------------
+def _square_maps(side: int) -> List[List[int]]:
+    """The 8 symmetries of a side x side square as index permutations (old index -> new index)."""
+    n = side - 1
+    transforms = [
+        lambda x, y: (x, y),
+        lambda x, y: (n - y, x),
+        lambda x, y: (n - x, n - y),
+        lambda x, y: (y, n - x),
+        lambda x, y: (n - x, y),
+        lambda x, y: (x, n - y),
+        lambda x, y: (y, x),
+        lambda x, y: (n - y, n - x),
+    ]
+    maps = []
+    for t in transforms:
+        m = []
+        for i in range(side * side):
+            x, y = t(i % side, i // side)
+            m.append(y * side + x)
+        maps.append(m)
+    return maps
+
+
+@lru_cache(maxsize=None)
+def symmetries(side: int, depth: int) -> Tuple[Tuple[Tuple[int, ...], Tuple[int, ...]], ...]:
+    """
+    For each symmetry: (cell map, board map), each old index -> new index.
+    The same square symmetry is applied to the digit at every level, which is
+    what keeps forced-board targets and win lines intact.
+    """
+    cfg = get_config(side, depth)
+    out = []
+    for m in _square_maps(side):
+        def apply_digits(idx: int, levels: int) -> int:
+            new, scale = 0, 1
+            for _ in range(levels):
+                new += m[idx % cfg.area] * scale
+                idx //= cfg.area
+                scale *= cfg.area
+            return new
+        cells = tuple(apply_digits(c, depth) for c in range(cfg.num_cells))
+        boards = tuple(apply_digits(b, depth - 1) for b in range(cfg.num_boards))
+        out.append((cells, boards))
+    return tuple(out)
+
+
+def _inverse(perm: Sequence[int]) -> List[int]:
+    inv = [0] * len(perm)
+    for old, new in enumerate(perm):
+        inv[new] = old
+    return inv
+
+
+# -----------------------------------------------------
+# positions
+# -----------------------------------------------------
+class Position:
+    """A board plus whose turn it is. Kept picklable so it can go to worker processes."""
+    __slots__ = ("board", "turn", "players")
+
+    def __init__(self, board: UltimateBoard, turn: int, players: int):
+        self.board = board
+        self.turn = turn  # player id to move
+        self.players = players
+
+    def key(self, sym: int = 0) -> bytes:
+        """Encoding of this position seen through symmetry sym."""
+        b = self.board
+        cells_map, boards_map = symmetries(b.config.side, b.config.depth)[sym]
+        cells = bytearray(len(b.cells))
+        for old, new in enumerate(cells_map):
+            cells[new] = b.cells[old]
+        winners = bytearray(len(b.grid_winners))
+        for old, new in enumerate(boards_map):
+            winners[new] = b.grid_winners[old]
+        forced = boards_map[b.next_forced] if b.next_forced >= 0 else -1
+        head = (f"{b.config.side}/{b.config.depth}/{b.win_rule}/{int(b.reset_on_tie)}/"
+                f"{self.players}/{self.turn}/{forced}/{b.macro_winner}/{int(b.macro_tied)}|").encode()
+        return head + bytes(cells) + bytes(winners)
+
+    def canonical(self) -> Tuple[bytes, int]:
+        """(smallest key over all symmetries, symmetry that produced it)."""
+        best, best_sym = None, 0
+        for sym in range(8):
+            k = self.key(sym)
+            if best is None or k < best:
+                best, best_sym = k, sym
+        return best, best_sym
+
+    def transformed(self, sym: int) -> "Position":
+        b = self.board
+        cells_map, boards_map = symmetries(b.config.side, b.config.depth)[sym]
+        nb = b.copy()
+        for old, new in enumerate(cells_map):
+            nb.cells[new] = b.cells[old]
+        for old, new in enumerate(boards_map):
+            nb.grid_winners[new] = b.grid_winners[old]
+        nb.next_forced = boards_map[b.next_forced] if b.next_forced >= 0 else -1
+        nb._recode()
+        # mid-level winners only exist for depth > 2; rebuild them in the new frame
+        area = b.config.area
+        for k, level in enumerate(b.level_winners):
+            span = area ** (k + 1)
+            for j, w in enumerate(level):
+                nb.level_winners[k][boards_map[j * span] // span] = w
+        return Position(nb, self.turn, self.players)
+
+
+def _require(item: dict, keys: Sequence[str], what: str):
+    missing = [k for k in keys if k not in item]
+    if missing:
+        raise ValueError(f"{what} needs {', '.join(missing)} (see analysis module docstring)")
+
+
+def parse_position(item: dict) -> Position:
+    if "moves" in item:
+        _require(item, ("players", "reset_on_tie"), "a move list")
+        players = int(item["players"])
+        board = UltimateBoard(reset_on_tie=bool(item["reset_on_tie"]),
+                              win_rule=item.get("win_rule", "adjacent-2"),
+                              side=item.get("side", 3), depth=item.get("depth", 2))
+        turn = 1
+        for big, small in item["moves"]:
+            if not board.apply(turn, (int(big), int(small))):
+                raise ValueError(f"illegal move {big},{small} in move list")
+            turn = turn % players + 1
+        return Position(board, turn, players)
+    if "board" not in item:
+        raise ValueError("a bare board doesn't say whose turn it is: "
+                         "pass {\"board\": ..., \"turn\": ..., \"players\": ..., \"reset_on_tie\": ...}")
+    if "players" not in item and "required_players" in item:
+        item = {**item, "players": item["required_players"]}
+    _require(item, ("turn", "players", "reset_on_tie"), "a board")
+    players = int(item["players"])
+    turn = mark_id(item["turn"])
+    if not 1 <= turn <= players:
+        raise ValueError(f"turn {item['turn']!r} isn't one of the {players} players")
+    board = UltimateBoard.from_dict(item["board"], reset_on_tie=bool(item["reset_on_tie"]))
+    return Position(board, turn, players)
+
+
+# -----------------------------------------------------
+# search
+# -----------------------------------------------------
+def evaluate(board: UltimateBoard, me: int, players: int) -> int:
+    """Static score for player me: decided boards, plus two-in-a-row threats on 3x3 boards."""
+    if board.macro_winner:
+        return WIN_SCORE if board.macro_winner == me else -WIN_SCORE
+    if board.macro_tied:
+        return 0
+    score = 0
+    others = players - 1
+    for w in board._top_winners():
+        if w == me:
+            score += BOARD_SCORE * others
+        elif w and w != TIE:
+            score -= BOARD_SCORE
+    if board.codes is not None:
+        table = small_table()
+        for b, code in enumerate(board.codes):
+            if board.grid_winners[b]:
+                continue
+            for p in range(1, min(players, 3) + 1):
+                t = table.threats(code, p)
+                if t:
+                    score += THREAT_SCORE * t * (others if p == me else -1)
+    return score
+
+
+class _OutOfNodes(Exception):
+    pass
+
+
+def search(pos: Position, depth: int = DEFAULT_DEPTH, max_nodes: int = DEFAULT_NODES
+           ) -> Tuple[int, Optional[Tuple[int, int]], int]:
+    """
+    Iterative-deepening alpha-beta. With more than two players it is "paranoid":
+    everyone else plays to minimise the player to move. Returns
+    (score for the player to move, best move, deepest completed depth).
+    """
+    me = pos.turn
+    nodes = [0]
+
+    def alphabeta(board: UltimateBoard, turn: int, d: int, alpha: int, beta: int) -> int:
+        nodes[0] += 1
+        if nodes[0] > max_nodes:
+            raise _OutOfNodes
+        if d == 0 or board.macro_winner or board.macro_tied:
+            return evaluate(board, me, pos.players)
+        moves = board.legal_moves()
+        if not moves:
+            return evaluate(board, me, pos.players)
+        nxt = turn % pos.players + 1
+        if turn == me:
+            best = -WIN_SCORE - 1
+            for m in moves:
+                child = board.copy()
+                child.apply(turn, m)
+                best = max(best, alphabeta(child, nxt, d - 1, alpha, beta))
+                alpha = max(alpha, best)
+                if alpha >= beta:
+                    break
+            return best
+        best = WIN_SCORE + 1
+        for m in moves:
+            child = board.copy()
+            child.apply(turn, m)
+            best = min(best, alphabeta(child, nxt, d - 1, alpha, beta))
+            beta = min(beta, best)
+            if alpha >= beta:
+                break
+        return best
+
+    moves = pos.board.legal_moves()
+    if not moves:
+        return evaluate(pos.board, me, pos.players), None, 0
+    result = (evaluate(pos.board, me, pos.players), moves[0], 0)
+    nxt = me % pos.players + 1
+    for d in range(1, depth + 1):
+        try:
+            best_score, best_move = -WIN_SCORE - 1, moves[0]
+            alpha = -WIN_SCORE - 1
+            for m in moves:
+                child = pos.board.copy()
+                child.apply(me, m)
+                s = alphabeta(child, nxt, d - 1, alpha, WIN_SCORE + 1)
+                if s > best_score:
+                    best_score, best_move = s, m
+                alpha = max(alpha, s)
+            result = (best_score, best_move, d)
+            # try the best move first next time round
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+        except _OutOfNodes:
+            break
+    return result
+
+
+def _analyze_one(pos: Position, depth: int, max_nodes: int) -> dict:
+    """Analysis in the position's own orientation (runs in a worker process)."""
+    b = pos.board
+    score, best, reached = search(pos, depth, max_nodes)
+    return {
+        "legal_moves": [list(m) for m in b.legal_moves()],
+        "macro_winner": MARK_OF[b.macro_winner],
+        "macro_tied": b.macro_tied,
+        "turn": MARK_OF[pos.turn],
+        "score": score,
+        "best_move": list(best) if best else None,
+        "depth": reached,
+    }
+
+
+def _map_result(result: dict, cell_perm: Sequence[int], area: int) -> dict:
+    """Copy of result with its moves sent through a cell permutation."""
+    def move(m):
+        cell = cell_perm[m[0] * area + m[1]]
+        return [cell // area, cell % area]
+
+    out = dict(result)
+    out["legal_moves"] = sorted(move(m) for m in result["legal_moves"])
+    out["best_move"] = move(result["best_move"]) if result["best_move"] else None
+    return out
+
+
+# -----------------------------------------------------
+# cache + batch entry point
+# -----------------------------------------------------
+class PositionCache:
+    """Thread-safe LRU of canonical key -> analysis (in canonical orientation)."""
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self.data: "OrderedDict[bytes, dict]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self.lock:
+            v = self.data.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key: bytes, value: dict):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+_cache = PositionCache()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: Optional[int]) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def analyze(positions: Sequence[dict], depth: int = DEFAULT_DEPTH, max_nodes: int = DEFAULT_NODES,
+            workers: Optional[int] = None, cache: Optional[PositionCache] = None) -> List[dict]:
+    """Analyse a batch of positions (see module docstring). Results come back in input order."""
+    cache = _cache if cache is None else cache
+    parsed = [parse_position(p) for p in positions]
+
+    # canonical key + which symmetry gets us there, per input
+    keyed = []
+    found: Dict[bytes, dict] = {}
+    todo: Dict[bytes, Position] = {}
+    for pos in parsed:
+        key, sym = pos.canonical()
+        key += f"|{depth}/{max_nodes}".encode()
+        keyed.append((key, sym))
+        if key in found or key in todo:
+            continue
+        hit = cache.get(key)
+        if hit is None:
+            todo[key] = pos.transformed(sym)
+        else:
+            found[key] = hit
+
+    if todo:
+        keys = list(todo)
+        jobs = [todo[k] for k in keys]
+        if len(jobs) < POOL_THRESHOLD:
+            answers = [_analyze_one(p, depth, max_nodes) for p in jobs]
+        else:
+            pool = _get_pool(workers)
+            answers = list(pool.map(_analyze_one, jobs, [depth] * len(jobs), [max_nodes] * len(jobs)))
+        for k, a in zip(keys, answers):
+            cache.put(k, a)
+            found[k] = a
+
+    results = []
+    for pos, (key, sym) in zip(parsed, keyed):
+        cfg: BoardConfig = pos.board.config
+        cells_map, _ = symmetries(cfg.side, cfg.depth)[sym]
+        # canonical frame -> caller's frame
+        results.append(_map_result(found[key], _inverse(cells_map), cfg.area))
+    return results
+
+
+def cache_stats() -> Dict[str, int]:
+    return {"size": len(_cache.data), "hits": _cache.hits, "misses": _cache.misses}
+
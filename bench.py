@@ -0,0 +1,440 @@
+"""
+Benchmarks for the engine, protocol and rendering hot paths.
+
+    python bench.py                    # run everything, compare with the baseline
+    python bench.py apply serialize    # just these
+    python bench.py --save             # run, then make the results the new baseline
+
+bench_baseline.json holds the numbers from the last --save (commit it along
+with the change that moved them). Every run prints baseline / now / change
+next to each number and marks changes worse than REGRESSION with "!!". Keys
+ending in _per_s are better when higher; everything else (times, bytes) is
+better when lower. The baseline is machine-specific: re-save it before
+comparing on a different machine.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import common
+from common import UltimateBoard
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+REGRESSION = 0.10  # flag anything more than 10% worse than the baseline
+REPEATS = 5  # timing loops report the best of this many runs
+
+
+def random_game(board: UltimateBoard, players: int = 2, max_moves: int = -1, rng=random) -> int:
+    """Play random legal moves on board until the game ends (or max_moves). Returns moves played."""
+    turn = 0
+    played = 0
+    while not (board.macro_winner or board.macro_tied) and played != max_moves:
+        legal = board.legal_moves()
+        board.apply(turn + 1, rng.choice(legal))
+        turn = (turn + 1) % players
+        played += 1
+    return played
+
+
+def recorded_games(n: int, reset_on_tie: bool, seed: int = 7, max_moves: int = 400
+                   ) -> List[List[Tuple[int, int]]]:
+    """Move lists of n random legal games (so timing loops don't pay for picking moves)."""
+    rng = random.Random(seed)
+    games = []
+    for _ in range(n):
+        board = UltimateBoard(reset_on_tie=reset_on_tie)
+        moves = []
+        turn = 1
+        while not (board.macro_winner or board.macro_tied) and len(moves) < max_moves:
+            move = rng.choice(board.legal_moves())
+            board.apply(turn, move)
+            moves.append(move)
+            turn = 3 - turn
+        games.append(moves)
+    return games
+
+
+def best_time(fn: Callable[[], None], repeats: int = REPEATS) -> float:
+    """Fastest of several runs of fn, in seconds (the minimum is the least noisy estimate)."""
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def mid_game(moves: int = 30, seed: int = 3) -> UltimateBoard:
+    board = UltimateBoard()
+    random_game(board, max_moves=moves, rng=random.Random(seed))
+    return board
+
+
+# -----------------------------------------------------
+# benchmarks
+# -----------------------------------------------------
+def bench_memory(n: int = 5000) -> Dict[str, float]:
+    """Bytes per live UltimateBoard, empty and after 30 random moves."""
+    results = {}
+    rng = random.Random(1)
+    for label, moves in (("empty", 0), ("mid-game", 30)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        games: List[UltimateBoard] = []
+        for _ in range(n):
+            b = UltimateBoard()
+            if moves:
+                random_game(b, max_moves=moves, rng=rng)
+            games.append(b)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[f"bytes_per_game_{label}"] = (after - before) / n
+        del games
+    return results
+
+
+def bench_small_table(lookups: int = 200000) -> Dict[str, float]:
+    """Build/load time of the 3x3 small-board table, and a lookup vs. the line scan it replaces."""
+    results = {}
+    t0 = time.perf_counter()
+    data = common.build_small_table()
+    results["build_s"] = time.perf_counter() - t0
+
+    common.small_table()  # make sure the cache file exists
+    t0 = time.perf_counter()
+    table = common._map_table(common.TABLE_PATH)
+    results["load_ms"] = (time.perf_counter() - t0) * 1000
+    if table is None:
+        table = common.SmallBoardTable(data)
+
+    rng = random.Random(2)
+    boards = [bytes(rng.randrange(3) for _ in range(9)) for _ in range(1000)]
+    codes = [common.encode_small(b) for b in boards]
+    t0 = time.perf_counter()
+    for i in range(lookups):
+        table.winner(codes[i % 1000])
+    results["lookup_ns"] = (time.perf_counter() - t0) / lookups * 1e9
+    t0 = time.perf_counter()
+    for i in range(lookups):
+        common.line_winner(boards[i % 1000], 0, common.WIN_LINES)
+    results["line_scan_ns"] = (time.perf_counter() - t0) / lookups * 1e9
+    return results
+
+
+def _time_until(cmd: List[str], marker: str, env: Dict[str, str] = None, timeout: float = 30.0) -> float:
+    """Seconds from spawning cmd until marker shows up on its stdout."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=here, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            env={**os.environ, **(env or {})}, text=True)
+    try:
+        for line in proc.stdout:
+            if marker in line:
+                return time.perf_counter() - t0
+        return float("nan")
+    finally:
+        proc.kill()
+        proc.wait(timeout)
+
+
+def bench_startup(runs: int = 5) -> Dict[str, float]:
+    """
+    Interpreter launch until the server listens / the client module is importable.
+    server_listen_cold_ms is a fresh checkout: no small-board table on disk yet.
+    """
+    import tempfile
+    py = sys.executable
+    results = {}
+    server = [_time_until([py, "server.py", "--port", "0"], "Listening") for _ in range(runs)]
+    results["server_listen_ms"] = min(server) * 1000
+    cold = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            table = os.path.join(tmp, "table.bin")
+            cold.append(_time_until([py, "server.py", "--port", "0"], "Listening", {"UTTT_TABLE": table}))
+    results["server_listen_cold_ms"] = min(cold) * 1000
+    bare = [_time_until([py, "-c", "print('up')"], "up") for _ in range(runs)]
+    results["python_bare_ms"] = min(bare) * 1000
+    try:
+        import pygame  # noqa: F401
+    except ImportError:
+        return results
+    client = [_time_until([py, "-c", "import client; print('up')"], "up", {"SDL_VIDEODRIVER": "dummy"})
+              for _ in range(runs)]
+    results["client_import_ms"] = min(client) * 1000
+    return results
+
+
+def bench_apply(games: int = 200) -> Dict[str, float]:
+    """UltimateBoard.apply (and legal_moves) over recorded random games, both reset_on_tie modes."""
+    results = {}
+    for label, reset in (("keep_ties", False), ("reset_on_tie", True)):
+        recorded = recorded_games(games, reset)
+        total = sum(len(g) for g in recorded)
+
+        def play():
+            for moves in recorded:
+                board = UltimateBoard(reset_on_tie=reset)
+                turn = 1
+                for move in moves:
+                    board.apply(turn, move)
+                    turn = 3 - turn
+
+        dt = best_time(play)
+        results[f"apply_ns_{label}"] = dt / total * 1e9
+        results[f"{label}_moves_per_s"] = total / dt
+
+        positions = []
+        board = UltimateBoard(reset_on_tie=reset)
+        turn = 1
+        for move in recorded[0]:
+            positions.append(board.copy())
+            board.apply(turn, move)
+            turn = 3 - turn
+
+        def legal():
+            for pos in positions:
+                pos.legal_moves()
+
+        results[f"legal_moves_ns_{label}"] = best_time(legal) / len(positions) * 1e9
+    return results
+
+
+def bench_update_macro(calls: int = 20000) -> Dict[str, float]:
+    """UltimateBoard._update_macro on mid-game positions (2 levels, and 3 levels deep)."""
+    results = {}
+    for label, side, depth in (("3x3", 3, 2), ("3x3x3", 3, 3)):
+        board = UltimateBoard(side=side, depth=depth)
+        random_game(board, max_moves=10 * board.config.num_boards // 9, rng=random.Random(4))
+        bigs = [b for b in range(board.config.num_boards) if board.grid_winners[b]] or [0]
+        order = [bigs[i % len(bigs)] for i in range(calls)]
+
+        def update():
+            for big in order:
+                board._update_macro(big)
+
+        results[f"update_macro_ns_{label}"] = best_time(update) / calls * 1e9
+    return results
+
+
+def bench_serialize(calls: int = 2000) -> Dict[str, float]:
+    """
+    serialize() and json.dumps of a mid-game board: time and size on the wire.
+    serialize_us is right after a move (what a broadcast pays); serialize_cached_us
+    is a repeat call with nothing changed (e.g. a name-change broadcast).
+    """
+    board = mid_game()
+    data = board.serialize()
+    moves = recorded_games(1, False)[0]
+
+    def after_move():
+        b = UltimateBoard()
+        turn = 1
+        spent = 0.0
+        for move in moves:
+            b.apply(turn, move)
+            turn = 3 - turn
+            t0 = time.perf_counter()
+            b.serialize()
+            spent += time.perf_counter() - t0
+        return spent
+
+    def cached():
+        for _ in range(calls):
+            board.serialize()
+
+    def dumps():
+        for _ in range(calls):
+            json.dumps(data)
+
+    return {
+        "serialize_us": min(after_move() for _ in range(REPEATS)) / len(moves) * 1e6,
+        "serialize_cached_us": best_time(cached) / calls * 1e6,
+        "dumps_us": best_time(dumps) / calls * 1e6,
+        "json_bytes": len(json.dumps(data)),
+    }
+
+
+def _feed(sock: socket.socket, data: bytes):
+    sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def bench_recv(messages: int = 20000) -> Dict[str, float]:
+    """LineReader parsing throughput over a socketpair: small moves, and states the size of a broadcast."""
+    import server
+    move = b'{"type": "move", "big": 4, "small": 7, "seq": 12}\n'
+    state = server.encode({"type": "state", "turn": "X", "board": mid_game().serialize()})
+    results = {}
+    for label, line, n in (("move", move, messages), ("state", state, messages // 10)):
+        def read():
+            a, b = socket.socketpair()
+            writer = threading.Thread(target=_feed, args=(a, line * n))
+            writer.start()
+            reader = server.LineReader(b)
+            for _ in range(n):
+                reader.read()
+            writer.join()
+            a.close()
+            b.close()
+
+        results[f"line_reader_{label}_msgs_per_s"] = n / best_time(read)
+    return results
+
+
+def _drain(sock: socket.socket):
+    try:
+        while sock.recv(65536):
+            pass
+    except OSError:
+        pass
+
+
+def bench_broadcast(rounds: int = 100) -> Dict[str, float]:
+    """GameServer.broadcast_state fan-out to N subscribers over socketpairs."""
+    import server
+    from timers import TimerWheel
+    results = {}
+    for n in (2, 16, 64):
+        gs = server.GameServer(2, idle_timeout=0, wheel=TimerWheel(), max_spectators=n)
+        gs.board = mid_game()
+        ends = []
+        for i in range(n):
+            ours, theirs = socket.socketpair()
+            gs.members.add(ours)
+            threading.Thread(target=_drain, args=(theirs,), daemon=True).start()
+            ends.append((ours, theirs))
+
+        def broadcast():
+            for _ in range(rounds):
+                gs.broadcast_state()
+
+        results[f"broadcast_us_{n}"] = best_time(broadcast) / rounds * 1e6
+        for ours, theirs in ends:
+            ours.close()
+            theirs.close()
+    return results
+
+
+def bench_draw(frames: int = 100) -> Dict[str, float]:
+    """client.draw_board frame time under SDL's dummy video driver (skipped without pygame)."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    try:
+        import pygame
+    except ImportError:
+        return {}
+    import client
+    pygame.init()
+    screen = pygame.display.set_mode((client.WIDTH, client.HEIGHT))
+    assets = client.Assets()
+    font_small = assets.font(16)
+    st = client.ClientState()
+    st.handle({"type": "assign", "you_are": "X", "required_players": 2, "connected_players": 2})
+    st.handle({"type": "state", "turn": "X", "board": mid_game().serialize(),
+               "required_players": 2, "connected_players": 2})
+    client.draw_board(screen, st, assets, font_small)  # first frame loads the atlas
+
+    def draw():
+        for _ in range(frames):
+            client.draw_board(screen, st, assets, font_small)
+
+    results = {"draw_board_ms": best_time(draw) / frames * 1000}
+    pygame.quit()
+    return results
+
+
+BENCHMARKS: Dict[str, Callable[[], Dict[str, float]]] = {
+    "memory": bench_memory,
+    "small_table": bench_small_table,
+    "startup": bench_startup,
+    "apply": bench_apply,
+    "update_macro": bench_update_macro,
+    "serialize": bench_serialize,
+    "recv": bench_recv,
+    "broadcast": bench_broadcast,
+    "draw": bench_draw,
+}
+
+
+# -----------------------------------------------------
+# baseline / report
+# -----------------------------------------------------
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: str = BASELINE_PATH):
+    baseline = load_baseline(path)
+    baseline.update(results)  # benchmarks we didn't run keep their old numbers
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def change(key: str, old: float, new: float) -> Tuple[float, bool]:
+    """(relative change, worse than REGRESSION?) with the sign flipped so that + is always better."""
+    if not old:
+        return 0.0, False
+    rel = (new - old) / old
+    if not key.endswith("_per_s"):
+        rel = -rel
+    return rel, rel < -REGRESSION
+
+
+def report(name: str, results: Dict[str, float], baseline: Optional[Dict[str, float]], dt: float):
+    print(f"[{name}] ({dt:.2f}s)")
+    if not results:
+        print("  skipped")
+    for key, value in results.items():
+        old = (baseline or {}).get(key)
+        if old is None:
+            print(f"  {key:<32} {value:12.2f}")
+            continue
+        rel, bad = change(key, old, value)
+        print(f"  {key:<32} {old:12.2f} -> {value:12.2f}  {rel:+7.1%}{'  !!' if bad else ''}")
+
+
+def main(argv: List[str]):
+    p = argparse.ArgumentParser(description="Run benchmarks and compare them with the saved baseline")
+    p.add_argument("names", nargs="*", metavar="name",
+                   help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    p.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    p.add_argument("--baseline", default=BASELINE_PATH)
+    args = p.parse_args(argv)
+    unknown = [n for n in args.names if n not in BENCHMARKS]
+    if unknown:
+        p.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    baseline = load_baseline(args.baseline)
+    results = {}
+    regressions = 0
+    for name in args.names or list(BENCHMARKS):
+        t0 = time.perf_counter()
+        results[name] = BENCHMARKS[name]()
+        report(name, results[name], baseline.get(name), time.perf_counter() - t0)
+        for key, value in results[name].items():
+            old = baseline.get(name, {}).get(key)
+            if old is not None and change(key, old, value)[1]:
+                regressions += 1
+    if regressions:
+        print(f"{regressions} number(s) more than {REGRESSION:.0%} worse than the baseline")
+    if args.save:
+        save_baseline({k: v for k, v in results.items() if v}, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
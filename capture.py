@@ -0,0 +1,369 @@
+"""
+Traffic capture and deterministic replay, for benchmarking GameServer changes
+against real games instead of synthetic load.
+
+Capture (server side):
+
+    python server.py --capture games.cap
+
+Every connection the server accepts is wrapped so each inbound line and each
+outbound message is appended to the file with a timestamp. Format: an 8-byte
+magic, then records of
+
+    <u64 microseconds since start> <u32 connection> <u8 kind> <u32 length> <payload>
+
+kind is OPEN / IN / OUT / CLOSE, META (the GameServer settings, JSON, once
+at the top) or TIMEOUT (a turn clock ran out: the position it ran out in, JSON). One file holds one server run: Capture refuses an existing file,
+since a second run's connection ids and timestamps would start again from 0.
+Records are only ever appended, so a capture of a server that crashed is still
+readable up to the last complete record.
+
+Replay:
+
+    python capture.py replay games.cap --speed 10
+    python capture.py info games.cap
+
+The replayer builds a fresh GameServer with the recorded settings, opens one
+socketpair per recorded connection (in the recorded order, through
+GameServer.join) and sends the recorded inbound lines at the original times
+divided by --speed (0 = as fast as possible). Before sending a line it waits
+until that connection has seen the same board it had seen at capture time, so
+moves from different players arrive in the same order whatever the speed.
+At the end the outbound "state" messages per connection are compared with
+the capture: the game fields only (see COMPARED), with repeats collapsed,
+since how many broadcasts get coalesced depends on timing. Turn clocks are
+not run against the compressed time: the replayed room gets clocks that never
+run out, and each recorded TIMEOUT is fired by hand once the room has reached
+the position it happened in. Idle timeouts are not replayed (the connection's
+CLOSE is). Rate limits are
+scaled by --speed, so a capture in which a client got "Slow down" only
+replays faithfully at --speed 1.
+"""
+
+import argparse
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b"UTTTCAP1"
+RECORD = struct.Struct("<QIBI")
+
+OPEN, IN, OUT, CLOSE, META, TIMEOUT = range(6)
+KIND_NAMES = {OPEN: "open", IN: "in", OUT: "out", CLOSE: "close", META: "meta", TIMEOUT: "timeout"}
+
+# how long a replayed connection waits for the board it expects before sending anyway
+BARRIER_TIMEOUT = 2.0
+# turn time of a replayed clocked room: long enough never to run out by itself
+REPLAY_TURN_TIME = 1e6
+
+
+# -----------------------------------------------------
+# capture
+# -----------------------------------------------------
+class Capture:
+    """Append-only record file shared by all connections of one server."""
+    def __init__(self, path: str):
+        self.path = path
+        # "x": raises FileExistsError rather than mixing two runs in one file
+        self.file = open(path, "xb")
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.next_conn = 0
+
+    def write(self, conn: int, kind: int, payload: bytes = b""):
+        stamp = int((time.monotonic() - self.start) * 1e6)
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(RECORD.pack(stamp, conn, kind, len(payload)) + payload)
+            # one write syscall per record: a killed server leaves a readable file
+            self.file.flush()
+
+    def write_meta(self, settings: Dict):
+        self.write(0, META, json.dumps(settings).encode("utf-8"))
+
+    def write_timeout(self, position: tuple):
+        """position: GameServer._position() when the clock ran out."""
+        self.write(0, TIMEOUT, json.dumps(list(position)).encode("utf-8"))
+
+    def wrap(self, sock: socket.socket) -> "CaptureSocket":
+        with self.lock:
+            conn = self.next_conn
+            self.next_conn += 1
+        self.write(conn, OPEN)
+        return CaptureSocket(sock, self, conn)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class CaptureSocket:
+    """
+    Socket proxy that records what goes through it. Outbound: one record per
+    sendall() (= one message, see server.send). Inbound: recv() data is split
+    on newlines, one record per complete line.
+    """
+    def __init__(self, sock: socket.socket, capture: Capture, conn: int):
+        self.sock = sock
+        self.capture = capture
+        self.conn = conn
+        self.inbuf = b""
+        self.closed = False
+
+    def sendall(self, data: bytes):
+        self.capture.write(self.conn, OUT, data.rstrip(b"\n"))
+        return self.sock.sendall(data)
+
+    def recv(self, n: int) -> bytes:
+        chunk = self.sock.recv(n)
+        self.inbuf += chunk
+        while True:
+            nl = self.inbuf.find(b"\n")
+            if nl < 0:
+                break
+            self.capture.write(self.conn, IN, self.inbuf[:nl])
+            self.inbuf = self.inbuf[nl + 1:]
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.capture.write(self.conn, CLOSE)
+        self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def read_records(path: str) -> Iterator[Tuple[float, int, int, bytes]]:
+    """(seconds, connection, kind, payload) for every complete record in the file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a capture file")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            stamp, conn, kind, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield stamp / 1e6, conn, kind, payload
+
+
+# -----------------------------------------------------
+# replay
+# -----------------------------------------------------
+# the parts of a "state" that must come out the same at any replay speed; names,
+# connection counts and clock readings depend on timing, so they are left out
+COMPARED = ("turn", "board", "acks", "forfeited")
+
+
+def _state_key(msg: Dict) -> Optional[str]:
+    """What we compare for a "state" message (None for other messages)."""
+    if msg.get("type") != "state":
+        return None
+    return json.dumps({k: msg.get(k) for k in COMPARED}, sort_keys=True)
+
+
+def _collapse(items: List[str]) -> List[str]:
+    out = []
+    for item in items:
+        if not out or out[-1] != item:
+            out.append(item)
+    return out
+
+
+class ReplayConnection:
+    """Client end of one replayed connection: collects what the server sends it."""
+    def __init__(self, conn: int, sock: socket.socket):
+        self.conn = conn
+        self.sock = sock
+        self.received: List[Dict] = []
+        self.board: Optional[Dict] = None  # board in the latest state we got
+        self.last_key: Optional[str] = None  # _state_key of the latest state we got
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.thread.start()
+
+    def read_loop(self):
+        from server import LineReader
+        reader = LineReader(self.sock, max_line=1 << 24)
+        while True:
+            msg = reader.read()
+            if msg is None:
+                break
+            with self.cond:
+                self.received.append(msg)
+                if msg.get("type") == "state":
+                    self.board = msg.get("board")
+                    self.last_key = _state_key(msg)
+                self.cond.notify_all()
+
+    def wait_for_key(self, key: str, timeout: float) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: self.last_key == key, timeout)
+
+    def wait_for_board(self, board: Optional[Dict], timeout: float) -> bool:
+        if board is None:
+            return True
+        with self.cond:
+            return self.cond.wait_for(lambda: self.board == board, timeout)
+
+
+class Replay:
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self.records = list(read_records(path))
+        self.settings: Dict = {}
+        for _, _, kind, payload in self.records:
+            if kind == META:
+                self.settings = json.loads(payload)
+                break
+
+    def make_server(self):
+        from server import RATE_LIMITS, GameServer
+        settings = dict(self.settings)
+        # clocks and idle timeouts depend on wall time, which we are compressing;
+        # a clocked room keeps its clocks (they show up in the state) but the
+        # recorded TIMEOUTs decide when they run out
+        if settings.get("turn_time", 0.0) > 0:
+            settings["turn_time"] = REPLAY_TURN_TIME
+        settings.update(increment=0.0, idle_timeout=0.0)
+        # the limits are per second: a sped-up honest client must still fit
+        scale = self.speed if self.speed > 0 else 1e6
+        settings["rate_limits"] = {k: (rate * scale, burst * max(1, int(scale)))
+                                   for k, (rate, burst) in RATE_LIMITS.items()}
+        return GameServer(**settings)
+
+    def run(self) -> Dict:
+        gs = self.make_server()
+        conns: Dict[int, ReplayConnection] = {}
+        recorded: Dict[int, List[str]] = {}
+        last_board: Dict[int, Optional[Dict]] = {}
+        sent = 0
+        stalls = 0
+
+        t0 = time.monotonic()
+        for stamp, conn, kind, payload in self.records:
+            if self.speed > 0:
+                delay = stamp / self.speed - (time.monotonic() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == OPEN:
+                ours, theirs = socket.socketpair()
+                conns[conn] = ReplayConnection(conn, theirs)
+                recorded[conn] = []
+                last_board[conn] = None
+                gs.join(ours)
+            elif kind == OUT:
+                msg = json.loads(payload)
+                key = _state_key(msg)
+                if key is not None:
+                    recorded[conn].append(key)
+                    last_board[conn] = msg.get("board")
+            elif kind == IN:
+                rc = conns[conn]
+                if not rc.wait_for_board(last_board[conn], BARRIER_TIMEOUT):
+                    stalls += 1
+                try:
+                    rc.sock.sendall(payload + b"\n")
+                    sent += 1
+                except OSError:
+                    pass
+            elif kind == TIMEOUT:
+                if not self._fire_timeout(gs, tuple(json.loads(payload))):
+                    stalls += 1
+            elif kind == CLOSE and conn in conns:
+                # let the server's last messages for this connection arrive first
+                conns[conn].wait_for_board(last_board[conn], BARRIER_TIMEOUT)
+                try:
+                    conns[conn].sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        # connections that were never closed (e.g. the server was killed): let
+        # their last recorded state arrive before the shutdown cuts them off
+        for conn, rc in conns.items():
+            if recorded[conn] and not rc.wait_for_key(recorded[conn][-1], BARRIER_TIMEOUT):
+                stalls += 1
+        elapsed = time.monotonic() - t0
+
+        gs.running = False
+        gs.broadcast_shutdown()
+        for rc in conns.values():
+            rc.thread.join(BARRIER_TIMEOUT)
+
+        mismatched = []
+        for conn, rc in conns.items():
+            got = _collapse([k for k in map(_state_key, rc.received) if k is not None])
+            if got != _collapse(recorded[conn]):
+                mismatched.append(conn)
+        return {
+            "connections": len(conns),
+            "messages_in": sent,
+            "messages_out": sum(len(rc.received) for rc in conns.values()),
+            "elapsed_s": elapsed,
+            "barrier_stalls": stalls,
+            "mismatched": mismatched,
+        }
+
+
+    @staticmethod
+    def _fire_timeout(gs, position: tuple) -> bool:
+        """Run out the clock of whoever is to move, once gs is at position. False if it never got there."""
+        deadline = time.monotonic() + BARRIER_TIMEOUT
+        while True:
+            with gs.lock:
+                if gs._position() == position:
+                    serial = gs.turn_serial
+                    break
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        gs.on_turn_timeout(serial)
+        return True
+
+
+def info(path: str) -> Dict:
+    counts = {name: 0 for name in KIND_NAMES.values()}
+    conns = set()
+    duration = 0.0
+    for stamp, conn, kind, _ in read_records(path):
+        counts[KIND_NAMES.get(kind, "?")] = counts.get(KIND_NAMES.get(kind, "?"), 0) + 1
+        if kind != META:
+            conns.add(conn)
+        duration = stamp
+    return {"connections": len(conns), "duration_s": duration, **counts}
+
+
+def main(argv: Optional[List[str]] = None):
+    p = argparse.ArgumentParser(description="Inspect or replay a server traffic capture")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("replay", help="feed a capture back into a fresh GameServer and check the output")
+    r.add_argument("path")
+    r.add_argument("--speed", type=float, default=1.0, help="time compression (0 = no waiting)")
+    i = sub.add_parser("info", help="summarise a capture")
+    i.add_argument("path")
+    args = p.parse_args(argv)
+
+    if args.cmd == "info":
+        results = info(args.path)
+    else:
+        results = Replay(args.path, args.speed).run()
+    for key, value in results.items():
+        print(f"  {key:<16} {value}")
+    if args.cmd == "replay" and results["mismatched"]:
+        print("[REPLAY] state messages differ from the capture")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
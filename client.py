@@ -3,14 +3,17 @@ import socket
 import threading
 import pygame
 import os
-from typing import Optional, Dict, Tuple
+import time
+import zlib
+from typing import Optional, Dict, List, Tuple
 
-from server import GameServer  # for hosting in-thread
+from common import MARK_OF, MARKS, MAX_PLAYERS, BoardConfig, UltimateBoard, get_config, get_rules, mark_id
 
 
 WIDTH, HEIGHT = 720, 720
 PORT = 8765
 TOP_BAR = 50
+KEEPALIVE = 30.0  # seconds between pings, keeps the server's idle timeout away
 
 # screens
 SCREEN_USERNAME = "username"
@@ -31,6 +34,29 @@ COLOR_MUTED = (148, 163, 184)
 COLOR_ACCENT = (56, 189, 248)
 PURE_WHITE = (255, 255, 255)
 
+# mark -> sprite; marks without one are drawn as coloured letters
+MARK_SPRITES = {
+    "X": "images/circlesquare.png",
+    "O": "images/oval.png",
+    "Z": "images/tear.png",
+}
+# every image we use, packed into one atlas on first run (see Assets)
+ATLAS_IMAGES = {
+    "board": "images/board.png",
+    "logo": "images/logo.png",
+    **MARK_SPRITES,
+}
+ATLAS_SPRITE = 512  # px per image in the atlas (sources are 1080x1080)
+ATLAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+MARK_COLORS = {
+    "A": (250, 204, 21),
+    "V": (74, 222, 128),
+    "H": (244, 114, 182),
+    "K": (251, 146, 60),
+    "M": (167, 139, 250),
+}
+
 
 # ---------------------------------------------------------
 # NETWORK HELPERS
@@ -65,6 +91,9 @@ def recv_thread(sock: socket.socket, on_msg):
 
 
 def start_server_in_thread(required_players: int):
+    # imported here so the client window doesn't wait for the server module
+    from server import GameServer
+
     def run():
         gs = GameServer(required_players)
         gs.run()
@@ -72,14 +101,29 @@ def start_server_in_thread(required_players: int):
     t.start()
 
 
-def connect_to_server(host: str, port: int, state, username: str) -> socket.socket:
+def connect_to_server(host: str, port: int, state, username: str, room: str = "",
+                      seat_token: Optional[str] = None) -> socket.socket:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((host, port))
     threading.Thread(target=recv_thread, args=(s, state.handle), daemon=True).start()
-    send(s, {"type": "hello", "name": username})
+    # hello goes first: a sharded server (server.py --workers) routes on it
+    hello = {"type": "hello", "name": username}
+    if room:
+        hello["room"] = room
+    if seat_token:
+        # we left this game mid-way: ask for our seat back
+        hello["seat_token"] = seat_token
+    send(s, hello)
     return s
 
 
+def parse_target(text: str) -> Tuple[str, int, str]:
+    """ "10.0.0.5", "10.0.0.5:9000" or "10.0.0.5/ROOM" -> (host, port, room)"""
+    text, _, room = text.partition("/")
+    host, _, port = text.partition(":")
+    return host, int(port) if port.isdigit() else PORT, room.strip()
+
+
 def get_local_ip() -> str:
     try:
         tmp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -95,18 +139,126 @@ def get_local_ip() -> str:
 # CLIENT STATE
 # ---------------------------------------------------------
 class ClientState:
+    """
+    Everything the UI knows about the game.
+
+    Moves are predicted locally: we keep the last board the server sent us
+    (server_board) plus a list of our own moves it hasn't acknowledged yet
+    (pending). What we draw is server_board with pending re-applied on top.
+    The server echoes the seq of the last move it processed from us in "acks",
+    so every state/error message is a chance to drop or roll back predictions.
+    """
     def __init__(self):
         self.you_are: Optional[str] = None
         self.turn: str = "X"
         self.board = None
         self.required_players: int = 2
         self.connected_players: int = 0
+        self.started: bool = False  # server says the game is on (stays on if someone leaves)
         self.player_names: Dict[str, str] = {}
         self.spectator_names = []
         self.last_error: Optional[str] = None
         self.disconnected: bool = False  # for remote shutdown
+        self.seat_token: Optional[str] = None  # from "assign"; gets our seat back if we rejoin
+        # turn clocks (only if the server runs them): mark -> seconds left when the state arrived
+        self.clocks: Dict[str, float] = {}
+        self.clock_stamp: float = 0.0
+        # server's endgame solver: {"result": "win", "winner": mark} / {"result": "draw"} / None
+        self.forecast: Optional[Dict] = None
+
+        # board configuration, negotiated in "assign"
+        self.config: BoardConfig = get_config()
+
+        # prediction / reconciliation
+        self.reset_on_tie: bool = False
+        self.server_board: Optional[UltimateBoard] = None
+        self.server_turn: str = "X"
+        self.pending: List[Tuple[int, int, int]] = []  # (seq, big, small)
+        self.move_seq: int = 0
+        self.lock = threading.Lock()
+
+        # bumped every time self.board changes; macro_status() is cached against it
+        self.version: int = 0
+        self._macro_cache: Tuple[int, str, bool] = (-1, "", False)
+
+    @property
+    def player_order(self) -> List[str]:
+        return list(MARKS[:self.required_players])
+
+    def _next_mark(self, mark: str) -> str:
+        order = self.player_order
+        if mark not in order:
+            return mark
+        return order[(order.index(mark) + 1) % len(order)]
+
+    def _set_board(self, board: Optional[dict]):
+        self.board = board
+        self.version += 1
+
+    def macro_status(self) -> Tuple[str, bool]:
+        """(macro_winner, macro_tied) for the board we are showing, evaluated once per version."""
+        version, winner, tied = self._macro_cache
+        if version != self.version:
+            winner, tied = "", False
+            if self.board:
+                winner = self.board.get("macro_winner", "")
+                tied = self.board.get("macro_tied", False)
+                if not (winner or tied):
+                    # servers that don't send the macro result: the rule applies to
+                    # the top level, which is a mid level when depth > 2
+                    rules = get_rules(self.board.get("win_rule", "adjacent-2"), self.config.side)
+                    top = (self.board.get("level_winners") or [self.board["grid_winners"]])[-1]
+                    win_id, tied = rules.evaluate([mark_id(w) for w in top])
+                    winner = MARK_OF[win_id]
+            self._macro_cache = (self.version, winner, tied)
+        return winner, tied
+
+    def _rebuild(self):
+        """Re-apply pending moves on top of the last server state; roll back if any no longer fits."""
+        if self.server_board is None:
+            return
+        predicted = self.server_board.copy()
+        turn = self.server_turn
+        for _, big, small in self.pending:
+            if turn != self.you_are or not predicted.apply(mark_id(turn), (big, small)):
+                # server disagrees with us -> trust the server
+                self.pending = []
+                predicted = self.server_board
+                turn = self.server_turn
+                break
+            if not predicted.macro_winner and not predicted.macro_tied:
+                turn = self._next_mark(turn)
+        self._set_board(predicted.serialize())
+        self.turn = turn
+
+    def predict_move(self, big: int, small: int) -> Optional[dict]:
+        """
+        Apply our own move locally. Returns the message to send, or None if the
+        move is obviously illegal (so it never goes over the network).
+        """
+        with self.lock:
+            if self.server_board is None:
+                return None
+            if self.turn != self.you_are:
+                self.last_error = "Not your turn"
+                return None
+            predicted = UltimateBoard.from_dict(self.board, reset_on_tie=self.reset_on_tie)
+            if not predicted.apply(mark_id(self.you_are), (big, small)):
+                self.last_error = "Illegal move"
+                return None
+            self.move_seq += 1
+            self.pending.append((self.move_seq, big, small))
+            self._set_board(predicted.serialize())
+            if not predicted.macro_winner and not predicted.macro_tied:
+                self.turn = self._next_mark(self.turn)
+            self.last_error = None
+            return {"type": "move", "big": big, "small": small, "seq": self.move_seq}
 
     def handle(self, msg: Dict):
+        with self.lock:
+            self._handle(msg)
+
+    def _handle(self, msg: Dict):
         t = msg.get("type")
         if t == "assign":
             self.you_are = msg.get("you_are")
@@ -114,16 +266,32 @@ class ClientState:
             self.connected_players = msg.get("connected_players", 1)
             self.player_names = msg.get("player_names", {})
             self.spectator_names = msg.get("spectator_names", [])
+            self.reset_on_tie = msg.get("reset_on_tie", False)
+            self.config = get_config(msg.get("side", 3), msg.get("depth", 2))
+            self.seat_token = msg.get("seat_token", self.seat_token)
         elif t == "state":
-            self.turn = msg.get("turn")
-            self.board = msg.get("board")
+            self.server_turn = msg.get("turn")
+            self.server_board = UltimateBoard.from_dict(msg.get("board"), reset_on_tie=self.reset_on_tie)
             self.required_players = msg.get("required_players", self.required_players)
             self.connected_players = msg.get("connected_players", self.connected_players)
+            self.started = msg.get("started", self.started)
             self.player_names = msg.get("player_names", self.player_names)
             self.spectator_names = msg.get("spectator_names", self.spectator_names)
+            self.clocks = msg.get("clocks", {})
+            self.clock_stamp = time.monotonic()
+            self.forecast = msg.get("forecast")
             self.last_error = None
+            # anything the server has already processed is baked into this state
+            acked = msg.get("acks", {}).get(self.you_are, 0)
+            self.pending = [p for p in self.pending if p[0] > acked]
+            self._rebuild()
         elif t == "error":
             self.last_error = msg.get("message")
+            seq = msg.get("seq", 0)
+            if seq:
+                # rejected move (and everything predicted after it) is rolled back
+                self.pending = [p for p in self.pending if p[0] < seq]
+                self._rebuild()
         elif t == "shutdown":
             # server told us to go home
             self.disconnected = True
@@ -141,12 +309,93 @@ def load_image(path: str):
         return None
 
 
+class Assets:
+    """
+    Images and fonts, loaded the first time something asks for them so the
+    window can open before any of it is read.
+
+    Images come from one atlas (all ATLAS_IMAGES side by side at ATLAS_SPRITE
+    px), built from the full-size sources on first run and cached next to the
+    bytecode; afterwards startup reads one small PNG instead of five big ones.
+    Scaled copies are cached too, since draw_board asks for the same sizes every frame.
+    """
+    def __init__(self):
+        self._images: Optional[Dict[str, "pygame.Surface"]] = None
+        self._scaled: Dict[Tuple[str, int, int], "pygame.Surface"] = {}
+        self._fonts: Dict[Tuple[int, bool], "pygame.font.Font"] = {}
+
+    def font(self, size: int, bold: bool = False) -> "pygame.font.Font":
+        key = (size, bold)
+        f = self._fonts.get(key)
+        if f is None:
+            f = self._fonts[key] = pygame.font.SysFont("Segoe UI", size, bold=bold)
+        return f
+
+    def _atlas_path(self) -> str:
+        # layout depends on the image list, so it's part of the name
+        layout = zlib.crc32("|".join(ATLAS_IMAGES).encode("utf-8"))
+        return os.path.join(ATLAS_DIR, f"atlas-{ATLAS_SPRITE}-{layout:08x}.png")
+
+    def _build_atlas(self, path: str) -> Optional["pygame.Surface"]:
+        names = list(ATLAS_IMAGES)
+        atlas = pygame.Surface((ATLAS_SPRITE * len(names), ATLAS_SPRITE), pygame.SRCALPHA)
+        for i, name in enumerate(names):
+            img = load_image(ATLAS_IMAGES[name])
+            if img:
+                atlas.blit(pygame.transform.smoothscale(img, (ATLAS_SPRITE, ATLAS_SPRITE)), (i * ATLAS_SPRITE, 0))
+        try:
+            os.makedirs(ATLAS_DIR, exist_ok=True)
+            pygame.image.save(atlas, path)
+        except (OSError, pygame.error):
+            pass
+        return atlas
+
+    def _load(self) -> Dict[str, "pygame.Surface"]:
+        path = self._atlas_path()
+        sources = [p for p in ATLAS_IMAGES.values() if os.path.exists(p)]
+        stale = not os.path.exists(path) or any(os.path.getmtime(p) > os.path.getmtime(path) for p in sources)
+        atlas = None if stale else load_image(path)
+        if atlas is None:
+            atlas = self._build_atlas(path)
+        images = {}
+        for i, name in enumerate(ATLAS_IMAGES):
+            if ATLAS_IMAGES[name] in sources:
+                images[name] = atlas.subsurface((i * ATLAS_SPRITE, 0, ATLAS_SPRITE, ATLAS_SPRITE))
+        return images
+
+    def image(self, name: str) -> Optional["pygame.Surface"]:
+        if self._images is None:
+            self._images = self._load()
+        return self._images.get(name)
+
+    def scaled(self, name: str, w: int, h: int) -> Optional["pygame.Surface"]:
+        key = (name, w, h)
+        surf = self._scaled.get(key)
+        if surf is None:
+            img = self.image(name)
+            if img is None:
+                return None
+            surf = self._scaled[key] = pygame.transform.smoothscale(img, (w, h))
+        return surf
+
+
 def draw_button(screen, rect, text, font, bg, fg=(10, 22, 33)):
     pygame.draw.rect(screen, bg, rect, border_radius=12)
     txt = font.render(text, True, fg)
     screen.blit(txt, txt.get_rect(center=rect.center))
 
 
+def host_choice_rect(n: int) -> pygame.Rect:
+    """Button for hosting an n-player game (2..MAX_PLAYERS), two per row."""
+    i = n - 2
+    return pygame.Rect(60 + (i % 2) * 310, 200 + (i // 2) * 80, 290, 60)
+
+
+def end_forced_rect() -> pygame.Rect:
+    """Host's "end it now" button, shown once the server says the result is forced."""
+    return pygame.Rect(WIDTH - 200, HEIGHT - 56, 184, 40)
+
+
 def draw_input(screen, rect, text, font, placeholder=""):
     pygame.draw.rect(screen, COLOR_INPUT_BG, rect, border_radius=14)
     pygame.draw.rect(screen, COLOR_BORDER, rect, 1, border_radius=14)
@@ -156,67 +405,13 @@ def draw_input(screen, rect, text, font, placeholder=""):
     screen.blit(surf, (rect.x + 10, rect.y + (rect.height - surf.get_height()) // 2))
 
 
-# ---------------------------------------------------------
-# LOCAL WIN CHECK (client-side)
-# ---------------------------------------------------------
-def client_evaluate_macro(board_dict: dict) -> Tuple[str, bool]:
-    """
-    Try to infer the winner from the 9 big squares, even if the server didn't set macro_winner.
-    Rules:
-    1) If any adjacent pair (horizontal/vertical) is the same non-empty, non-T -> that mark wins
-       (this is your custom "2 big squares next to each other = win")
-    2) Else, classic 3-in-a-row ultimate check
-    3) Else, if all 9 are decided (winner or T) -> draw
-    """
-    winners = board_dict.get("grid_winners", [])
-    if not winners or len(winners) < 9:
-        return "", False
-
-    # 1) pair rule
-    pair_indices = [
-        # horizontal pairs
-        (0, 1), (1, 2),
-        (3, 4), (4, 5),
-        (6, 7), (7, 8),
-        # vertical pairs
-        (0, 3), (3, 6),
-        (1, 4), (4, 7),
-        (2, 5), (5, 8),
-    ]
-    for a, b in pair_indices:
-        wa, wb = winners[a], winners[b]
-        if wa and wa == wb and wa != "T":
-            return wa, False
-
-    # 2) normal 3-in-a-row
-    lines = [
-        (0, 1, 2),
-        (3, 4, 5),
-        (6, 7, 8),
-        (0, 3, 6),
-        (1, 4, 7),
-        (2, 5, 8),
-        (0, 4, 8),
-        (2, 4, 6),
-    ]
-    for a, b, c in lines:
-        wa, wb, wc = winners[a], winners[b], winners[c]
-        if wa and wa == wb == wc and wa != "T":
-            return wa, False
-
-    # 3) draw if everything decided
-    if all(w != "" for w in winners):
-        return "", True
-
-    return "", False
-
-
 # ---------------------------------------------------------
 # DRAW BOARD
 # ---------------------------------------------------------
-def draw_board(screen, st: ClientState, board_img, x_img, o_img, z_img, font_small):
+def draw_board(screen, st: ClientState, assets: Assets, font_small):
     """
     Draws the game board and, if game is over, draws HOME button.
+    Images come from assets (board + one sprite per mark, see MARK_SPRITES).
     Returns: pygame.Rect or None
     """
     screen.fill((15, 23, 42))
@@ -227,52 +422,47 @@ def draw_board(screen, st: ClientState, board_img, x_img, o_img, z_img, font_sma
         screen.blit(surf, surf.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
         return None
 
+    cfg = st.config
     usable_h = HEIGHT - TOP_BAR
-    cell = usable_h // 3
-    small = cell // 3
-
-    grid_winners = st.board.get("grid_winners", [""] * 9)
-
-    # -- figure out if the game is over (server OR client detection) --
-    srv_macro_winner = st.board.get("macro_winner", "")
-    srv_macro_tied = st.board.get("macro_tied", False)
-    if srv_macro_winner or srv_macro_tied:
-        macro_winner = srv_macro_winner
-        macro_tied = srv_macro_tied
-    else:
-        # do local
-        loc_winner, loc_tied = client_evaluate_macro(st.board)
-        macro_winner = loc_winner
-        macro_tied = loc_tied
+    small = usable_h // cfg.width  # one cell
+    cell = small * cfg.side  # one small board
+
+    def board_pos(b: int) -> Tuple[int, int]:
+        x, y = cfg.board_xy(b)
+        return x * small, TOP_BAR + y * small
+
+    grid_winners = st.board.get("grid_winners", [""] * cfg.num_boards)
+
+    # -- figure out if the game is over (cached per state version) --
+    macro_winner, macro_tied = st.macro_status()
 
     # base grids
-    for b in range(9):
-        bx = (b % 3) * cell
-        by = TOP_BAR + (b // 3) * cell
+    for b in range(cfg.num_boards):
+        bx, by = board_pos(b)
         winner = grid_winners[b]
         if winner:
             pygame.draw.rect(screen, PURE_WHITE, (bx, by, cell, cell))
         else:
+            board_img = assets.scaled("board", cell, cell) if cfg.side == 3 else None
             if board_img:
-                screen.blit(pygame.transform.smoothscale(board_img, (cell, cell)), (bx, by))
+                screen.blit(board_img, (bx, by))
             else:
                 pygame.draw.rect(screen, (15, 23, 42), (bx, by, cell, cell))
                 pygame.draw.rect(screen, (51, 65, 85), (bx, by, cell, cell), 2)
-                for j in range(1, 3):
+                for j in range(1, cfg.side):
                     pygame.draw.line(screen, (71, 85, 105), (bx + j * small, by), (bx + j * small, by + cell), 2)
                     pygame.draw.line(screen, (71, 85, 105), (bx, by + j * small), (bx + cell, by + j * small), 2)
 
     # small marks
     mark_scale = 0.7
     mark_size = int(small * mark_scale)
-    for b in range(9):
+    for b in range(cfg.num_boards):
         if grid_winners[b]:
             continue
-        base_x = (b % 3) * cell
-        base_y = TOP_BAR + (b // 3) * cell
-        for i in range(9):
-            cx = i % 3
-            cy = i // 3
+        base_x, base_y = board_pos(b)
+        for i in range(cfg.area):
+            cx = i % cfg.side
+            cy = i // cfg.side
             xpix = base_x + cx * small
             ypix = base_y + cy * small
             val = st.board["grids"][b][i]
@@ -280,46 +470,51 @@ def draw_board(screen, st: ClientState, board_img, x_img, o_img, z_img, font_sma
                 continue
             draw_x = xpix + (small - mark_size) // 2
             draw_y = ypix + (small - mark_size) // 2
-            if val == "X" and x_img:
-                screen.blit(pygame.transform.smoothscale(x_img, (mark_size, mark_size)), (draw_x, draw_y))
-            elif val == "O" and o_img:
-                screen.blit(pygame.transform.smoothscale(o_img, (mark_size, mark_size)), (draw_x, draw_y))
-            elif val == "Z" and z_img:
-                screen.blit(pygame.transform.smoothscale(z_img, (mark_size, mark_size)), (draw_x, draw_y))
+            img = assets.scaled(val, mark_size, mark_size) if val in MARK_SPRITES else None
+            if img:
+                screen.blit(img, (draw_x, draw_y))
             else:
-                t = font_small.render(val, True, COLOR_TEXT)
+                t = font_small.render(val, True, MARK_COLORS.get(val, COLOR_TEXT))
                 screen.blit(t, t.get_rect(center=(xpix + small // 2, ypix + small // 2)))
 
+    def draw_winner(winner: str, bx: int, by: int, size: int):
+        big_scale = 0.85
+        big_size = int(size * big_scale)
+        center_x = bx + size // 2
+        center_y = by + size // 2
+        bi = assets.scaled(winner, big_size, big_size) if winner in MARK_SPRITES else None
+        if bi:
+            screen.blit(bi, bi.get_rect(center=(center_x, center_y)))
+        else:
+            t = font_small.render(winner, True, (15, 23, 42))
+            screen.blit(t, t.get_rect(center=(center_x, center_y)))
+
     # big winners (not T)
     for b, winner in enumerate(grid_winners):
         if not winner:
             continue
         if winner == "T":
             continue
-        bx = (b % 3) * cell
-        by = TOP_BAR + (b // 3) * cell
-        big_scale = 0.85
-        big_size = int(cell * big_scale)
-        center_x = bx + cell // 2
-        center_y = by + cell // 2
-        if winner == "X" and x_img:
-            bi = pygame.transform.smoothscale(x_img, (big_size, big_size))
-            screen.blit(bi, bi.get_rect(center=(center_x, center_y)))
-        elif winner == "O" and o_img:
-            bi = pygame.transform.smoothscale(o_img, (big_size, big_size))
-            screen.blit(bi, bi.get_rect(center=(center_x, center_y)))
-        elif winner == "Z" and z_img:
-            bi = pygame.transform.smoothscale(z_img, (big_size, big_size))
-            screen.blit(bi, bi.get_rect(center=(center_x, center_y)))
-        else:
-            t = font_small.render(winner, True, (15, 23, 42))
-            screen.blit(t, t.get_rect(center=(center_x, center_y)))
+        bx, by = board_pos(b)
+        draw_winner(winner, bx, by, cell)
+
+    # mid-level winners (depth > 2): cover the whole block
+    for k, level in enumerate(st.board.get("level_winners", [])):
+        span = cfg.area ** (k + 1)  # small boards per mid board
+        size = cell * cfg.side ** (k + 1)
+        for j, winner in enumerate(level):
+            if not winner:
+                continue
+            bx, by = board_pos(j * span)
+            pygame.draw.rect(screen, PURE_WHITE, (bx, by, size, size))
+            pygame.draw.rect(screen, (51, 65, 85), (bx, by, size, size), 2)
+            if winner != "T":
+                draw_winner(winner, bx, by, size)
 
     # forced highlight
     forced = st.board["next_forced"]
     if isinstance(forced, int) and forced >= 0 and not (macro_winner or macro_tied):
-        fx = (forced % 3) * cell
-        fy = TOP_BAR + (forced // 3) * cell
+        fx, fy = board_pos(forced)
         overlay = pygame.Surface((cell, cell), pygame.SRCALPHA)
         overlay.fill((30, 64, 175, 80))
         screen.blit(overlay, (fx, fy))
@@ -341,34 +536,32 @@ def draw_board(screen, st: ClientState, board_img, x_img, o_img, z_img, font_sma
         else:
             msg = "DRAW!"
 
-        big_font = pygame.font.SysFont("Segoe UI", 56, bold=True)
+        big_font = assets.font(56, bold=True)
         text_surf = big_font.render(msg, True, (239, 246, 255))
         screen.blit(text_surf, text_surf.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 40)))
 
         # HOME button
         home_rect = pygame.Rect(WIDTH // 2 - 90, HEIGHT // 2 + 20, 180, 48)
-        btn_font = pygame.font.SysFont("Segoe UI", 22, bold=True)
+        btn_font = assets.font(22, bold=True)
         draw_button(screen, home_rect, "HOME", btn_font, COLOR_ACCENT, (10, 22, 33))
         return home_rect
 
     return None
 
 
-def pixel_to_move(mx, my) -> Tuple[int, int]:
+def pixel_to_move(mx, my, cfg: Optional[BoardConfig] = None) -> Tuple[int, int]:
+    cfg = cfg or get_config()
     usable_h = HEIGHT - TOP_BAR
-    cell = usable_h // 3
-    small = cell // 3
+    small = usable_h // cfg.width
     if my < TOP_BAR:
         return -1, -1
-    my_adj = my - TOP_BAR
-    big_x = mx // cell
-    big_y = my_adj // cell
-    if not (0 <= big_x < 3 and 0 <= big_y < 3):
+    x = mx // small
+    y = (my - TOP_BAR) // small
+    if not (0 <= x < cfg.width and 0 <= y < cfg.width):
         return -1, -1
-    small_x = (mx % cell) // small
-    small_y = (my_adj % cell) // small
-    big = big_y * 3 + big_x
-    small_idx = small_y * 3 + small_x
+    # precomputed screen position -> flat cell index
+    cell = cfg.xy_cell[y * cfg.width + x]
+    big, small_idx = divmod(cell, cfg.area)
     return big, small_idx
 
 
@@ -378,22 +571,18 @@ def pixel_to_move(mx, my) -> Tuple[int, int]:
 def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
-
-    board_img = load_image("images/board.png")
-    x_img = load_image("images/circlesquare.png")
-    o_img = load_image("images/oval.png")
-    z_img = load_image("images/tear.png")
-    logo = load_image("images/logo.png")
-
     pygame.display.set_caption("Ultimate Tic-Tac-Toe")
-    if logo:
-        pygame.display.set_icon(logo)
+    # show the window straight away; fonts and images load after this
+    screen.fill(COLOR_BG)
+    pygame.display.flip()
     clock = pygame.time.Clock()
 
-    font_title = pygame.font.SysFont("Segoe UI", 42, bold=True)
-    font_sub = pygame.font.SysFont("Segoe UI", 26)
-    font_body = pygame.font.SysFont("Segoe UI", 22)
-    font_small = pygame.font.SysFont("Segoe UI", 18)
+    assets = Assets()
+    font_title = assets.font(42, bold=True)
+    font_sub = assets.font(26)
+    font_body = assets.font(22)
+    font_small = assets.font(18)
+    icon_set = False
 
     screen_mode = SCREEN_USERNAME
     username = ""
@@ -401,12 +590,14 @@ def main():
     join_error = ""
     client_socket: Optional[socket.socket] = None
     client_state = ClientState()
+    joined: Dict[str, ClientState] = {}  # address typed in -> our latest session there
     host_local_ip = "127.0.0.1"
     i_am_host = False
 
     # used ONLY when game is over to detect HOME
     pending_home_click: Optional[Tuple[int, int]] = None
 
+    last_ping = time.monotonic()
     running = True
     while running:
         # if server told us to shutdown, go home
@@ -453,30 +644,22 @@ def main():
                     mx, my = e.pos
                     if pygame.Rect(30, 30, 90, 36).collidepoint(mx, my):
                         screen_mode = SCREEN_MENU
-                    elif pygame.Rect(210, 240, 300, 60).collidepoint(mx, my):
-                        # host 2p
-                        start_server_in_thread(2)
-                        client_state = ClientState()
-                        try:
-                            client_socket = connect_to_server("127.0.0.1", PORT, client_state, username)
-                            host_local_ip = get_local_ip()
-                            screen_mode = SCREEN_HOST_LOBBY
-                            i_am_host = True
-                        except OSError:
-                            screen_mode = SCREEN_MENU
-                            i_am_host = False
-                    elif pygame.Rect(210, 320, 300, 60).collidepoint(mx, my):
-                        # host 3p
-                        start_server_in_thread(3)
-                        client_state = ClientState()
-                        try:
-                            client_socket = connect_to_server("127.0.0.1", PORT, client_state, username)
-                            host_local_ip = get_local_ip()
-                            screen_mode = SCREEN_HOST_LOBBY
-                            i_am_host = True
-                        except OSError:
-                            screen_mode = SCREEN_MENU
-                            i_am_host = False
+                    else:
+                        for n in range(2, MAX_PLAYERS + 1):
+                            if not host_choice_rect(n).collidepoint(mx, my):
+                                continue
+                            # host an n-player game
+                            start_server_in_thread(n)
+                            client_state = ClientState()
+                            try:
+                                client_socket = connect_to_server("127.0.0.1", PORT, client_state, username)
+                                host_local_ip = get_local_ip()
+                                screen_mode = SCREEN_HOST_LOBBY
+                                i_am_host = True
+                            except OSError:
+                                screen_mode = SCREEN_MENU
+                                i_am_host = False
+                            break
 
             # IP INPUT
             elif screen_mode == SCREEN_IP_INPUT:
@@ -491,9 +674,14 @@ def main():
                     elif e.key == pygame.K_RETURN:
                         target = ip_text.strip()
                         if target:
+                            # rejoining a game we had a seat in: bring its token along
+                            previous = joined.get(target)
                             client_state = ClientState()
+                            host, port, room = parse_target(target)
                             try:
-                                client_socket = connect_to_server(target, PORT, client_state, username)
+                                client_socket = connect_to_server(host, port, client_state, username, room,
+                                                                  previous.seat_token if previous else None)
+                                joined[target] = client_state
                                 screen_mode = SCREEN_GAME
                                 i_am_host = False
                             except OSError:
@@ -502,30 +690,33 @@ def main():
                     elif e.key == pygame.K_BACKSPACE:
                         ip_text = ip_text[:-1]
                     else:
-                        if e.unicode.isdigit() or e.unicode in (".", ":"):
+                        # digits/dots/colon for the address; anything after "/" is a room code
+                        if e.unicode.isdigit() or e.unicode in (".", ":", "/") or ("/" in ip_text and e.unicode.isalnum()):
                             ip_text += e.unicode
 
             # GAME
             elif screen_mode == SCREEN_GAME:
                 if e.type == pygame.MOUSEBUTTONDOWN and e.button == 1 and client_state.board:
                     # figure out if, from the client's POV, the game is over
-                    # (use same helper as draw)
-                    tmp_winner, tmp_tied = client_evaluate_macro(client_state.board)
-                    srv_winner = client_state.board.get("macro_winner", "")
-                    srv_tied = client_state.board.get("macro_tied", False)
-                    game_over = bool(srv_winner or srv_tied or tmp_winner or tmp_tied)
+                    # (same cached result as draw)
+                    macro_winner, macro_tied = client_state.macro_status()
+                    game_over = bool(macro_winner or macro_tied)
 
                     if game_over:
                         # store click to check vs HOME button after draw
                         pending_home_click = e.pos
+                    elif i_am_host and client_state.forecast and end_forced_rect().collidepoint(*e.pos):
+                        send(client_socket, {"type": "end_forced"})
                     else:
                         # normal move
-                        if client_state.you_are in ("X", "O", "Z") and client_state.connected_players >= client_state.required_players:
-                            big, small = pixel_to_move(*e.pos)
+                        if client_state.you_are in MARKS and client_state.started:
+                            big, small = pixel_to_move(*e.pos, client_state.config)
                             if big != -1 and small != -1:
-                                send(client_socket, {"type": "move", "big": big, "small": small})
+                                move_msg = client_state.predict_move(big, small)
+                                if move_msg:
+                                    send(client_socket, move_msg)
                         else:
-                            if client_state.connected_players < client_state.required_players:
+                            if not client_state.started:
                                 client_state.last_error = "Waiting for players..."
                             else:
                                 client_state.last_error = "You are a spectator"
@@ -559,8 +750,11 @@ def main():
             draw_button(screen, back_rect, "Back", font_small, COLOR_PANEL_LIGHT, COLOR_TEXT)
             title = font_title.render("Host: choose players", True, COLOR_TEXT)
             screen.blit(title, title.get_rect(center=(WIDTH // 2, 130)))
-            draw_button(screen, pygame.Rect(210, 240, 300, 60), "2 PLAYERS", font_body, COLOR_ACCENT, (10, 22, 33))
-            draw_button(screen, pygame.Rect(210, 320, 300, 60), "3 PLAYERS", font_body, COLOR_PANEL_LIGHT, COLOR_TEXT)
+            for n in range(2, MAX_PLAYERS + 1):
+                if n == 2:
+                    draw_button(screen, host_choice_rect(n), f"{n} PLAYERS", font_body, COLOR_ACCENT, (10, 22, 33))
+                else:
+                    draw_button(screen, host_choice_rect(n), f"{n} PLAYERS", font_body, COLOR_PANEL_LIGHT, COLOR_TEXT)
 
         elif screen_mode == SCREEN_IP_INPUT:
             screen.fill(COLOR_BG)
@@ -569,7 +763,7 @@ def main():
             title = font_title.render("Join a game", True, COLOR_TEXT)
             screen.blit(title, title.get_rect(center=(WIDTH // 2, 130)))
             input_rect = pygame.Rect(140, 230, 440, 56)
-            draw_input(screen, input_rect, ip_text, font_body, "host IP (e.g. 10.0.0.5)")
+            draw_input(screen, input_rect, ip_text, font_body, "host IP (e.g. 10.0.0.5 or 10.0.0.5/ROOM)")
             hint = font_small.render("Press Enter to join. Must be on same network.", True, COLOR_MUTED)
             screen.blit(hint, hint.get_rect(center=(WIDTH // 2, 310)))
             if join_error:
@@ -590,7 +784,8 @@ def main():
             ip_surf = font_body.render(host_local_ip, True, COLOR_TEXT)
             screen.blit(ip_surf, ip_surf.get_rect(center=ip_rect.center))
 
-            pygame.draw.rect(screen, COLOR_PANEL, (80, 210, 560, 220), border_radius=18)
+            panel_h = max(220, 80 + 28 * client_state.required_players)
+            pygame.draw.rect(screen, COLOR_PANEL, (80, 210, 560, panel_h), border_radius=18)
             status = font_body.render(
                 f"Players: {client_state.connected_players}/{client_state.required_players}",
                 True,
@@ -598,17 +793,17 @@ def main():
             )
             screen.blit(status, (110, 230))
             y = 270
-            for mark in ("X", "O", "Z"):
+            for mark in MARKS:
                 if mark in client_state.player_names:
                     line = font_small.render(f"{mark}: {client_state.player_names[mark]}", True, COLOR_TEXT)
                     screen.blit(line, (120, y))
                     y += 28
 
-            if client_state.connected_players >= client_state.required_players:
+            if client_state.started:
                 screen_mode = SCREEN_GAME
 
         elif screen_mode == SCREEN_GAME:
-            home_button_rect = draw_board(screen, client_state, board_img, x_img, o_img, z_img, font_small)
+            home_button_rect = draw_board(screen, client_state, assets, font_small)
 
             # top bar
             pygame.draw.rect(screen, (14, 24, 36), (0, 0, WIDTH, TOP_BAR))
@@ -617,10 +812,20 @@ def main():
             your_name = client_state.player_names.get(role, "")
             label = f"You: {your_name} ({role})" if your_name else f"You: ({role})"
             info = f"{label}  |  Turn: {client_state.turn}  |  {client_state.connected_players}/{client_state.required_players}"
-            top_font = pygame.font.SysFont("Segoe UI", 20)
+            if client_state.turn in client_state.clocks:
+                left = client_state.clocks[client_state.turn] - (time.monotonic() - client_state.clock_stamp)
+                info += f"  |  {max(0.0, left):.0f}s"
+            forecast = client_state.forecast
+            if forecast:
+                info += "  |  " + (f"{forecast['winner']} wins by force" if forecast["result"] == "win"
+                                   else "Draw is forced")
+            top_font = assets.font(20)
             surf = top_font.render(info, True, COLOR_TEXT)
             screen.blit(surf, (10, (TOP_BAR - surf.get_height()) // 2))
 
+            if forecast and i_am_host and not any(client_state.macro_status()):
+                draw_button(screen, end_forced_rect(), "End game now", font_small, COLOR_ACCENT)
+
             if client_state.last_error:
                 err = font_small.render(client_state.last_error, True, (248, 113, 113))
                 screen.blit(err, (12, HEIGHT - 100))
@@ -646,6 +851,17 @@ def main():
         pygame.display.flip()
         clock.tick(60)
 
+        if client_socket and time.monotonic() - last_ping > KEEPALIVE:
+            send(client_socket, {"type": "ping"})
+            last_ping = time.monotonic()
+
+        if not icon_set:
+            # first frame is up; now it's fine to touch the atlas
+            logo = assets.image("logo")
+            if logo:
+                pygame.display.set_icon(logo)
+            icon_set = True
+
     pygame.quit()
 
 
@@ -2,185 +2,716 @@
 Shared game logic for Ultimate Tic Tac Toe.
 Used by both server.py and client.py.
 
-Board layout:
+Board layout (default side=3, depth=2):
 - 9 big boards (index 0..8), arranged 3x3
 - each big board has 9 cells (index 0..8), arranged 3x3
 
+Bigger games just change the numbers: side=4 gives 16 boards of 16 cells,
+depth=3 nests one more level (81 small boards grouped into 9 mid boards).
+All cells live in ONE flat list, indexed by
+
+    cell = big * area + small        (area = side * side)
+
+where big is the index of the bottom-level ("small") board. With depth 3,
+big itself is mid * area + small-within-mid, and so on.
+
+Inside the engine every player is a small int (1..MAX_PLAYERS), 0 is empty
+and TIE marks a drawn board, so win checks are plain int comparisons no
+matter how many players there are. The wire format still uses marks
+("X","O","Z",...,"T",""); serialize()/from_dict() translate via MARKS.
+
 We track:
-- per-small-board winner ("X","O","Z","T","")
+- per-small-board winner (player id, TIE, or 0)
+- per-mid-board winner for depth > 2 (same values)
 - macro winner (someone wins 2 adjacent small boards, for our custom rule)
-- next_forced: which big board the next player MUST play in
+- next_forced: which small board the next player MUST play in
 
 Extra for 3-player mode:
 - if reset_on_tie=True, a small board that fills without a winner is cleared
   so that it can be claimed again later.
 """
 
-from typing import List, Tuple
+import mmap
+import os
+import threading
+from array import array
+from functools import lru_cache
+from math import isqrt
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# -----------------------------------------------------
+# players
+# -----------------------------------------------------
+# mark for player id 1, 2, ... ("T" is reserved for ties)
+MARKS = ("X", "O", "Z", "A", "V", "H", "K", "M")
+MAX_PLAYERS = len(MARKS)
+
+EMPTY = 0
+TIE = MAX_PLAYERS + 1
+
+# id -> wire string, wire string -> id
+MARK_OF: Tuple[str, ...] = ("",) + MARKS + ("T",)
+MARK_IDS: Dict[str, int] = {m: i for i, m in enumerate(MARK_OF)}
+
+
+def mark_id(mark: str) -> int:
+    """Player id for a mark ("X" -> 1). Unknown marks map to EMPTY."""
+    return MARK_IDS.get(mark, EMPTY)
+
+
+# -----------------------------------------------------
+# line tables (generated once per board side)
+# -----------------------------------------------------
+def make_win_lines(side: int) -> List[Tuple[int, ...]]:
+    """Rows, cols and both diagonals of a side x side board."""
+    lines = []
+    for r in range(side):
+        lines.append(tuple(r * side + c for c in range(side)))
+    for c in range(side):
+        lines.append(tuple(r * side + c for r in range(side)))
+    lines.append(tuple(i * side + i for i in range(side)))
+    lines.append(tuple(i * side + (side - 1 - i) for i in range(side)))
+    return lines
+
+
+def make_adjacent_pairs(side: int) -> List[Tuple[int, int]]:
+    """Neighbouring cells along any win line (for 3x3: rows, cols, diagonals through middle)."""
+    pairs = []
+    for line in make_win_lines(side):
+        for a, b in zip(line, line[1:]):
+            pairs.append((a, b))
+    return pairs
 
 
 # normal 3x3 lines
-WIN_LINES = [
-    (0, 1, 2),
-    (3, 4, 5),
-    (6, 7, 8),
-    (0, 3, 6),
-    (1, 4, 7),
-    (2, 5, 8),
-    (0, 4, 8),
-    (2, 4, 6),
-]
+WIN_LINES = make_win_lines(3)
 
 # for the macro "two in a row" rule
-ADJACENT_PAIRS = [
-    # rows
-    (0, 1), (1, 2),
-    (3, 4), (4, 5),
-    (6, 7), (7, 8),
-    # cols
-    (0, 3), (3, 6),
-    (1, 4), (4, 7),
-    (2, 5), (5, 8),
-    # diagonals through middle
-    (0, 4), (4, 8),
-    (2, 4), (4, 6),
-]
+ADJACENT_PAIRS = make_adjacent_pairs(3)
+
+
+def line_winner(values: Sequence[int], start: int, lines: Sequence[Tuple[int, ...]]) -> int:
+    """
+    Winner of the board stored at values[start:start+area]:
+    a player id if it owns a whole line, TIE if every slot is decided, EMPTY otherwise.
+    """
+    for line in lines:
+        w = values[start + line[0]]
+        if not w or w == TIE:
+            continue
+        for i in line[1:]:
+            if values[start + i] != w:
+                break
+        else:
+            return w
+    for i in range(len(lines[0]) ** 2):
+        if not values[start + i]:
+            return EMPTY
+    return TIE
+
+
+# -----------------------------------------------------
+# precomputed 3x3 small-board table
+# -----------------------------------------------------
+# A 3x3 small board with EMPTY + up to 3 players has 4**9 states. Encode one as
+#     code = sum(cell[i] * 4**i)
+# and everything we want to know about it is a single lookup.
+#
+# The table is cached on disk (TABLE_PATH, or $UTTT_TABLE). On a fresh checkout
+# it isn't there yet, and building it takes most of a second, so boards don't
+# wait for it: table_if_ready() starts the build on a background thread and
+# boards made before it finishes use plain line scans for their whole life.
+TABLE_BASE = 4
+TABLE_SIZE = TABLE_BASE ** 9
+POW4 = tuple(TABLE_BASE ** i for i in range(9))
+# record: winner, full, empty-mask lo, empty-mask hi, threats p1, p2, p3, (pad)
+TABLE_RECORD = 8
+TABLE_PATH = os.environ.get("UTTT_TABLE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "__pycache__", "smallboard-3x3-b4.bin")
+
+
+class SmallBoardTable:
+    """Read-only view over the table bytes (an mmap, or a bytearray if we couldn't write the file)."""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def winner(self, code: int) -> int:
+        """Same answer as line_winner() on the decoded cells."""
+        return self.data[code * TABLE_RECORD]
+
+    def is_full(self, code: int) -> bool:
+        return self.data[code * TABLE_RECORD + 1] == 1
+
+    def empty_mask(self, code: int) -> int:
+        o = code * TABLE_RECORD
+        return self.data[o + 2] | self.data[o + 3] << 8
+
+    def threats(self, code: int, player: int) -> int:
+        """Lines where player (1..3) has two marks and the third cell is empty."""
+        return self.data[code * TABLE_RECORD + 3 + player]
+
+
+# empty-mask -> tuple of empty cell indexes
+MASK_CELLS = tuple(tuple(i for i in range(9) if m >> i & 1) for m in range(1 << 9))
+
+
+def encode_small(cells: Sequence[int], offset: int = 0) -> int:
+    """Table code for the 3x3 board at cells[offset:offset+9] (all values must be < TABLE_BASE)."""
+    code = 0
+    for i in range(9):
+        code += cells[offset + i] * POW4[i]
+    return code
+
+
+def build_small_table() -> bytearray:
+    data = bytearray(TABLE_SIZE * TABLE_RECORD)
+    lines = WIN_LINES
+    cells = [0] * 9
+    for code in range(TABLE_SIZE):
+        c = code
+        mask = 0
+        for i in range(9):
+            cells[i] = c & 3
+            c >>= 2
+            if not cells[i]:
+                mask |= 1 << i
+        winner = EMPTY
+        for a, b, d in lines:
+            w = cells[a]
+            if w and w == cells[b] == cells[d]:
+                winner = w
+                break
+        if not winner and not mask:
+            winner = TIE
+        threats = [0, 0, 0, 0]
+        for a, b, d in lines:
+            x, y, z = cells[a], cells[b], cells[d]
+            if x and x == y and not z:
+                threats[x] += 1
+            elif x and x == z and not y:
+                threats[x] += 1
+            elif y and y == z and not x:
+                threats[y] += 1
+        o = code * TABLE_RECORD
+        data[o] = winner
+        data[o + 1] = 0 if mask else 1
+        data[o + 2] = mask & 0xFF
+        data[o + 3] = mask >> 8
+        data[o + 4] = threats[1]
+        data[o + 5] = threats[2]
+        data[o + 6] = threats[3]
+    return data
+
+
+def _map_table(path: str) -> Optional[SmallBoardTable]:
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size != TABLE_SIZE * TABLE_RECORD:
+                return None
+            return SmallBoardTable(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        return None
+
+
+def load_small_table(path: str = TABLE_PATH) -> SmallBoardTable:
+    """Map the cached table, building (and caching) it first if needed."""
+    table = _map_table(path)
+    if table is not None:
+        return table
+    data = build_small_table()
+    import tempfile  # only needed on the (rare) build path; keeps import time down
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a concurrent reader never maps half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        return SmallBoardTable(data)
+    return _map_table(path) or SmallBoardTable(data)
+
+
+# mapped at import if it's already on disk, otherwise built on first use
+_SMALL_TABLE: Optional[SmallBoardTable] = _map_table(TABLE_PATH)
+_table_lock = threading.Lock()
+_table_builder: Optional[threading.Thread] = None
+
+
+def small_table() -> SmallBoardTable:
+    """The table, building it first (on this thread) if needed."""
+    global _SMALL_TABLE
+    if _SMALL_TABLE is None:
+        with _table_lock:
+            if _SMALL_TABLE is None:
+                _SMALL_TABLE = load_small_table()
+    return _SMALL_TABLE
+
+
+def table_if_ready() -> Optional[SmallBoardTable]:
+    """The table if it is loaded; otherwise start building it in the background and return None."""
+    global _table_builder
+    if _SMALL_TABLE is None and _table_builder is None:
+        with _table_lock:
+            if _table_builder is None:
+                _table_builder = threading.Thread(target=small_table, name="table-build", daemon=True)
+                _table_builder.start()
+    return _SMALL_TABLE
+
+
+class BoardConfig:
+    """
+    Everything that depends only on (side, depth), computed once.
+    Use get_config() so every board of the same shape shares one instance.
+    """
+    def __init__(self, side: int = 3, depth: int = 2):
+        if side < 2 or depth < 2:
+            raise ValueError("need side >= 2 and depth >= 2")
+        self.side = side
+        self.depth = depth
+        self.area = side * side                       # cells per board, at every level
+        self.num_cells = self.area ** depth
+        self.num_boards = self.area ** (depth - 1)    # small (bottom-level) boards
+        self.win_lines = make_win_lines(side)
+        self.adjacent_pairs = make_adjacent_pairs(side)
+
+        # screen layout: the whole game is a width x width grid of cells
+        self.width = side ** depth
+        # cell_xy[cell] = (x, y) and xy_cell[y * width + x] = cell
+        self.cell_xy: List[Tuple[int, int]] = [(0, 0)] * self.num_cells
+        self.xy_cell: List[int] = [0] * self.num_cells
+        for cell in range(self.num_cells):
+            x = y = 0
+            rest = cell
+            for level in range(depth):
+                digit = rest % self.area
+                rest //= self.area
+                x += (digit % side) * side ** level
+                y += (digit // side) * side ** level
+            self.cell_xy[cell] = (x, y)
+            self.xy_cell[y * self.width + x] = cell
+
+    def board_xy(self, big: int) -> Tuple[int, int]:
+        """Top-left cell (x, y) of small board big."""
+        return self.cell_xy[big * self.area]
+
+
+@lru_cache(maxsize=None)
+def get_config(side: int = 3, depth: int = 2) -> BoardConfig:
+    return BoardConfig(side, depth)
+
+
+class Rules:
+    """
+    Macro rule for one win_rule, compiled once into a line table.
+
+    win_rule:
+        - "adjacent-2":   two adjacent top-level boards (row, col or diagonal)
+        - "three-in-row": classic ultimate, a full line of top-level boards
+    Use get_rules() rather than building these directly, so both sides share one instance.
+    """
+    TABLES = {
+        "adjacent-2": "adjacent_pairs",
+        "three-in-row": "win_lines",
+    }
+
+    def __init__(self, win_rule: str = "adjacent-2", side: int = 3):
+        if win_rule not in self.TABLES:
+            raise ValueError(f"unknown win_rule {win_rule!r}")
+        self.win_rule = win_rule
+        self.side = side
+        table = getattr(get_config(side), self.TABLES[win_rule])
+        self.lines: Tuple[Tuple[int, ...], ...] = tuple(tuple(line) for line in table)
+
+    def evaluate(self, grid_winners: Sequence[int]) -> Tuple[int, bool]:
+        """Return (macro_winner, macro_tied) for the top-level board winners (player ids)."""
+        for line in self.lines:
+            w = grid_winners[line[0]]
+            if not w or w == TIE:
+                continue
+            for i in line[1:]:
+                if grid_winners[i] != w:
+                    break
+            else:
+                return w, False
+        # macro tie: only if ALL top-level boards are decided (winner or T) and no macro winner
+        return EMPTY, all(w != EMPTY for w in grid_winners)
+
+
+@lru_cache(maxsize=None)
+def get_rules(win_rule: str = "adjacent-2", side: int = 3) -> Rules:
+    return Rules(win_rule, side)
 
 
 class SmallBoard:
-    def __init__(self):
-        # 9 cells, "" means empty
-        self.cells: List[str] = [""] * 9
-        self.winner: str = ""  # "X","O","Z","T",""
-        self.tied: bool = False
+    """
+    One bottom-level board. By default it owns its cells and winner byte;
+    UltimateBoard.boards hands out read-only copies of slices of the game's arrays.
+    """
+    __slots__ = ("config", "cells", "offset", "winners", "index")
+
+    def __init__(self, side: int = 3, cells: Optional[bytearray] = None, offset: int = 0,
+                 winners: Optional[bytearray] = None, index: int = 0):
+        self.config = get_config(side)
+        # side*side cells, EMPTY (0) means empty
+        self.cells = cells if cells is not None else bytearray(self.config.area)
+        self.offset = offset
+        # winner lives in winners[index]: player id, TIE or EMPTY
+        self.winners = winners if winners is not None else bytearray(1)
+        self.index = index
+
+    @property
+    def winner(self) -> int:
+        return self.winners[self.index]
+
+    @winner.setter
+    def winner(self, value: int):
+        self.winners[self.index] = value
+
+    @property
+    def tied(self) -> bool:
+        return self.winners[self.index] == TIE
 
     def clear(self):
         """Make this small board playable again."""
-        self.cells = [""] * 9
-        self.winner = ""
-        self.tied = False
+        o = self.offset
+        self.cells[o:o + self.config.area] = bytes(self.config.area)
+        self.winner = EMPTY
 
     def is_full(self) -> bool:
-        return all(c != "" for c in self.cells)
+        o = self.offset
+        return EMPTY not in self.cells[o:o + self.config.area]
 
-    def apply(self, mark: str, idx: int) -> bool:
-        """Attempt to place mark at cell idx (0..8). Return True if success."""
-        if not (0 <= idx < 9):
+    def apply(self, player: int, idx: int) -> bool:
+        """Attempt to place player's mark at cell idx (0..area-1). Return True if success."""
+        if not (0 <= idx < self.config.area):
             return False
-        if self.cells[idx] != "":
+        if self.cells[self.offset + idx] != EMPTY:
             return False
         if self.winner:
             return False
-        self.cells[idx] = mark
+        self.cells[self.offset + idx] = player
         self._update_status()
         return True
 
     def _update_status(self):
-        # check win
-        for a, b, c in WIN_LINES:
-            if self.cells[a] and self.cells[a] == self.cells[b] == self.cells[c]:
-                self.winner = self.cells[a]
-                return
-        # check tie
-        if self.is_full() and not self.winner:
-            self.tied = True
-            self.winner = "T"  # tie-by-default (server may clear it later)
+        # check win, then tie (tie-by-default, server may clear it later)
+        o = self.offset
+        table = table_if_ready() if self.config.side == 3 else None
+        if table is not None and max(self.cells[o:o + 9]) < TABLE_BASE:
+            self.winner = table.winner(encode_small(self.cells, o))
+        else:
+            self.winner = line_winner(self.cells, o, self.config.win_lines)
 
     def serialize(self) -> List[str]:
-        return list(self.cells)
+        o = self.offset
+        return [MARK_OF[c] for c in self.cells[o:o + self.config.area]]
 
 
 class UltimateBoard:
-    def __init__(self, reset_on_tie: bool = False, win_rule: str = "adjacent-2"):
+    """
+    A whole game, kept compact: one bytearray of cells, one of small-board
+    winners (plus one per mid level for depth > 2) and a few small ints.
+    config and rules are shared per shape/rule, so they cost nothing per game.
+
+    serialize() is memoized: version is bumped on every change, the last
+    snapshot is reused until it moves, and each small board's cells are kept
+    as a tuple that is only rebuilt when that board changes. The snapshot is
+    shared with copies of the board but never handed out: every call returns
+    fresh lists built from it.
+    """
+    __slots__ = ("config", "cells", "grid_winners", "level_winners", "macro_winner",
+                 "macro_tied", "next_forced", "reset_on_tie", "win_rule", "rules", "codes",
+                 "version", "_snapshot", "_grid_snaps")
+
+    def __init__(self, reset_on_tie: bool = False, win_rule: str = "adjacent-2",
+                 side: int = 3, depth: int = 2, use_table: bool = True):
         """
         reset_on_tie:
             - False (2-player): a tied small board becomes dead ("T")
             - True  (3-player): a tied small board is immediately cleared so it can be won later
         win_rule:
-            - just sent to the client so it can display it
+            - which macro rule decides the game (see Rules); also sent to the client
+        side, depth:
+            - board shape, see module docstring
+        use_table:
+            - 3x3 only: keep a table code per small board so win/tie checks and
+              legal-move generation are lookups (see small_table()). Switched off
+              automatically once a player id >= TABLE_BASE plays, and from the
+              start if the table is still being built (see table_if_ready()).
         """
-        self.boards: List[SmallBoard] = [SmallBoard() for _ in range(9)]
-        self.grid_winners: List[str] = [""] * 9  # each is "", "X","O","Z","T"
-        self.macro_winner: str = ""  # if someone wins on macro
+        self.config = cfg = get_config(side, depth)
+        self.cells = bytearray(cfg.num_cells)
+        self.grid_winners = bytearray(cfg.num_boards)  # player id, TIE or EMPTY
+        # depth > 2 only: winners of the mid-level boards, lowest level first
+        self.level_winners: List[bytearray] = [
+            bytearray(cfg.area ** (depth - k)) for k in range(2, depth)
+        ]
+        self.macro_winner: int = EMPTY  # if someone wins on macro
         self.macro_tied: bool = False
         self.next_forced: int = -1  # -1 means "free"
         self.reset_on_tie = reset_on_tie
         self.win_rule = win_rule
+        self.rules = get_rules(win_rule, side)
+        # per small board: table code, or None when not using the table
+        self.codes: Optional[array] = None
+        if use_table and side == 3 and table_if_ready() is not None:
+            self.codes = array("I", bytes(4 * cfg.num_boards))
+        # serialize() cache: bumped on every change; (key, dict) of the last
+        # snapshot; per small board a tuple of marks, None when stale (the list
+        # itself only exists once something has been serialized)
+        self.version: int = 0
+        self._snapshot: Optional[Tuple[tuple, dict]] = None
+        self._grid_snaps: Optional[list] = None
+
+    @property
+    def boards(self) -> List[SmallBoard]:
+        """
+        Read-only SmallBoards of this game (built on demand, not stored). They
+        hold bytes copies: writing through them would bypass version/codes and
+        leave serialize() and the table codes stale, so that raises instead.
+        """
+        cfg = self.config
+        cells, winners = bytes(self.cells), bytes(self.grid_winners)
+        return [SmallBoard(cfg.side, cells, b * cfg.area, winners, b) for b in range(cfg.num_boards)]
 
     # -----------------------------------------------------
     # internal helpers
     # -----------------------------------------------------
-    def _update_macro(self):
-        # refresh per-board winners list
-        for i, sb in enumerate(self.boards):
-            self.grid_winners[i] = sb.winner
-
-        # OUR RULE: win if you have 2 adjacent decided boards (not T)
-        for a, b in ADJACENT_PAIRS:
-            wa, wb = self.grid_winners[a], self.grid_winners[b]
-            if wa and wb and wa == wb and wa != "T":
-                self.macro_winner = wa
-                return
-
-        # macro tie: only if ALL 9 small boards are decided (winner or T) and no macro winner
-        if all(w != "" for w in self.grid_winners) and not self.macro_winner:
-            self.macro_tied = True
+    def _top_winners(self) -> List[int]:
+        return self.level_winners[-1] if self.level_winners else self.grid_winners
+
+    def _playable(self, big: int) -> bool:
+        """Small board big is undecided and so is every mid board above it."""
+        if self.grid_winners[big]:
+            return False
+        idx = big
+        for level in self.level_winners:
+            idx //= self.config.area
+            if level[idx]:
+                return False
+        return True
+
+    def _clear_subtree(self, level: int, idx: int):
+        """Wipe mid board idx at level (0 = lowest mid level) and everything under it."""
+        area = self.config.area
+        span = area ** (level + 1)  # small boards under it
+        first = idx * span
+        self.cells[first * area:(first + span) * area] = bytes(span * area)
+        self.grid_winners[first:first + span] = bytes(span)
+        if self._grid_snaps is not None:
+            self._grid_snaps[first:first + span] = [None] * span
+        if self.codes is not None:
+            self.codes[first:first + span] = array("I", bytes(4 * span))
+        for k in range(level + 1):
+            n = area ** (level - k)
+            self.level_winners[k][idx * n:(idx + 1) * n] = bytes(n)
+
+    def _update_macro(self, big: int):
+        # refresh the winners on the path from small board big up to the top
+        area = self.config.area
+        child, idx = self.grid_winners, big
+        for k, level in enumerate(self.level_winners):
+            if not child[idx]:
+                break
+            idx //= area
+            level[idx] = line_winner(child, idx * area, self.config.win_lines)
+            if level[idx] == TIE and self.reset_on_tie:
+                self._clear_subtree(k, idx)
+                break
+            child = level
+
+        # OUR RULE by default: win if you have 2 adjacent decided boards (not T)
+        self.macro_winner, self.macro_tied = self.rules.evaluate(self._top_winners())
 
     # -----------------------------------------------------
     # public API
     # -----------------------------------------------------
-    def apply(self, mark: str, move: Tuple[int, int]) -> bool:
+    def is_legal(self, move: Tuple[int, int]) -> bool:
         """
+        Same checks as apply() but without touching the board.
+        The client uses this to drop obviously illegal clicks before they hit the network.
+        """
+        big_idx, small_idx = move
+        cfg = self.config
+        if not (0 <= big_idx < cfg.num_boards and 0 <= small_idx < cfg.area):
+            return False
+        if self.macro_winner or self.macro_tied:
+            return False
+        if self.next_forced >= 0 and big_idx != self.next_forced and self._playable(self.next_forced):
+            return False
+        return self._playable(big_idx) and self.cells[big_idx * cfg.area + small_idx] == EMPTY
+
+    def apply(self, player: int, move: Tuple[int, int]) -> bool:
+        """
+        player = player id (1..MAX_PLAYERS, see mark_id)
         move = (big_idx, small_idx)
         Enforces forced-board rule:
           - if next_forced >=0 and that board is still playable, you MUST play there
           - otherwise you can play anywhere valid
         Returns True if move applied.
         """
-        big_idx, small_idx = move
-
-        if not (0 <= big_idx < 9 and 0 <= small_idx < 9):
+        if not self.is_legal(move):
             return False
+        big_idx, small_idx = move
+        cfg = self.config
 
-        # if there is a forced board, check it is still active
-        if self.next_forced >= 0:
-            forced_board = self.boards[self.next_forced]
-            if not forced_board.winner and not forced_board.tied:
-                # you MUST play there
-                if big_idx != self.next_forced:
-                    return False
-            else:
-                # forced board is dead, so the player can play anywhere
-                self.next_forced = -1
+        # forced board is dead (or there isn't one), so the player can play anywhere
+        if self.next_forced >= 0 and big_idx != self.next_forced:
+            self.next_forced = -1
 
-        board = self.boards[big_idx]
-        ok = board.apply(mark, small_idx)
-        if not ok:
-            return False
+        offset = big_idx * cfg.area
+        self.cells[offset + small_idx] = player
+        self.version += 1
+        if self._grid_snaps is not None:
+            self._grid_snaps[big_idx] = None
+        codes = self.codes
+        if codes is not None and player >= TABLE_BASE:
+            # more players than the table covers: fall back to line checks
+            codes = self.codes = None
+        if codes is not None:
+            code = codes[big_idx] + player * POW4[small_idx]
+            codes[big_idx] = code
+            winner = _SMALL_TABLE.winner(code)
+        else:
+            winner = line_winner(self.cells, offset, cfg.win_lines)
 
         # if this move caused a tie on this small board
-        if board.tied and self.reset_on_tie:
+        if winner == TIE and self.reset_on_tie:
             # 3-player mode: wipe it — this board is still claimable later
-            board.clear()
-            self.grid_winners[big_idx] = ""
+            self.cells[offset:offset + cfg.area] = bytes(cfg.area)
+            if codes is not None:
+                codes[big_idx] = 0
+            self.grid_winners[big_idx] = EMPTY
+            self._update_macro(big_idx)
+            return True
+
+        # now recalc winners up the tree and the macro (with our 2-adjacent rule)
+        self.grid_winners[big_idx] = winner
+        self._update_macro(big_idx)
+
+        # normal flow: decide where the next player must go.
+        # the cell's position inside its parents picks the next small board
+        # (for depth 2 that's just small_idx)
+        target = (offset + small_idx) % cfg.num_boards
+        self.next_forced = target if self._playable(target) else -1
+        return True
+
+    def legal_moves(self) -> List[Tuple[int, int]]:
+        """Every (big_idx, small_idx) that apply() would accept right now."""
+        if self.macro_winner or self.macro_tied:
+            return []
+        cfg = self.config
+        if self.next_forced >= 0 and self._playable(self.next_forced):
+            bigs = [self.next_forced]
         else:
-            # normal flow: decide where the next player must go
-            target_board = self.boards[small_idx]
-            if not target_board.winner and not target_board.tied:
-                self.next_forced = small_idx
+            bigs = [b for b in range(cfg.num_boards) if self._playable(b)]
+        moves = []
+        codes = self.codes
+        for big in bigs:
+            if codes is not None:
+                moves.extend((big, i) for i in MASK_CELLS[_SMALL_TABLE.empty_mask(codes[big])])
             else:
-                self.next_forced = -1
+                o = big * cfg.area
+                moves.extend((big, i) for i in range(cfg.area) if not self.cells[o + i])
+        return moves
 
-        # now recalc macro (with our 2-adjacent rule)
-        self._update_macro()
-        return True
+    def _recode(self):
+        """Rebuild the table codes from cells and drop cached snapshots (after bulk loads)."""
+        self.version += 1
+        self._snapshot = None
+        self._grid_snaps = None
+        if self.codes is None:
+            return
+        if self.cells and max(self.cells) >= TABLE_BASE:
+            self.codes = None
+            return
+        for b in range(self.config.num_boards):
+            self.codes[b] = encode_small(self.cells, b * 9)
+
+    def copy(self) -> "UltimateBoard":
+        cfg = self.config
+        ub = UltimateBoard(self.reset_on_tie, self.win_rule, cfg.side, cfg.depth, self.codes is not None)
+        ub.cells[:] = self.cells
+        if self.codes is not None:
+            ub.codes[:] = self.codes
+        ub.grid_winners[:] = self.grid_winners
+        ub.level_winners = [bytearray(level) for level in self.level_winners]
+        ub.macro_winner = self.macro_winner
+        ub.macro_tied = self.macro_tied
+        ub.next_forced = self.next_forced
+        # snapshots are immutable, so the copy can start from ours
+        ub.version = self.version
+        ub._snapshot = self._snapshot
+        if self._grid_snaps is not None:
+            ub._grid_snaps = list(self._grid_snaps)
+        return ub
+
+    @classmethod
+    def from_dict(cls, data: dict, reset_on_tie: bool = False) -> "UltimateBoard":
+        """Rebuild a board from serialize() output (used for the client-side mirror)."""
+        grids = data["grids"]
+        area = len(grids[0])
+        depth = 2
+        while len(grids) > area ** (depth - 1):
+            depth += 1
+        ub = cls(reset_on_tie=reset_on_tie, win_rule=data.get("win_rule", "adjacent-2"),
+                 side=isqrt(area), depth=depth)
+        for b, cells in enumerate(grids):
+            ub.cells[b * area:(b + 1) * area] = bytes(MARK_IDS[c] for c in cells)
+        ub.grid_winners[:] = bytes(MARK_IDS[w] for w in data["grid_winners"])
+        if "level_winners" in data:
+            ub.level_winners = [bytearray(MARK_IDS[w] for w in level) for level in data["level_winners"]]
+        ub.next_forced = data.get("next_forced", -1)
+        ub.macro_winner = MARK_IDS[data.get("macro_winner", "")]
+        ub.macro_tied = data.get("macro_tied", False)
+        ub._recode()
+        return ub
 
     def serialize(self) -> dict:
-        return {
-            "grids": [sb.serialize() for sb in self.boards],
-            "grid_winners": list(self.grid_winners),
+        """
+        JSON-ready dict of lists; the caller owns it. Cached underneath: only
+        small boards changed since the last call are rebuilt from the cells.
+        """
+        data = self._snapshot_data()
+        out = dict(data)
+        out["grids"] = [list(grid) for grid in data["grids"]]
+        out["grid_winners"] = list(data["grid_winners"])
+        if "level_winners" in data:
+            out["level_winners"] = [list(level) for level in data["level_winners"]]
+        return out
+
+    def _snapshot_data(self) -> dict:
+        """serialize() as tuples, memoized; shared, so never returned to callers."""
+        # macro/forced state is in the key too, since the server sets
+        # macro_winner directly when a clock forfeit ends the game
+        key = (self.version, self.macro_winner, self.macro_tied, self.next_forced)
+        snap = self._snapshot
+        if snap is not None and snap[0] == key:
+            return snap[1]
+
+        area = self.config.area
+        cells = self.cells
+        grids = self._grid_snaps
+        if grids is None:
+            grids = self._grid_snaps = [None] * self.config.num_boards
+        if None in grids:
+            for b, grid in enumerate(grids):
+                if grid is None:
+                    o = b * area
+                    grids[b] = tuple([MARK_OF[c] for c in cells[o:o + area]])
+        data = {
+            "grids": tuple(grids),
+            "grid_winners": tuple([MARK_OF[w] for w in self.grid_winners]),
             "next_forced": self.next_forced,
-            "macro_winner": self.macro_winner,
+            "macro_winner": MARK_OF[self.macro_winner],
             "macro_tied": self.macro_tied,
             "win_rule": self.win_rule,
         }
+        if self.level_winners:
+            data["level_winners"] = tuple(tuple([MARK_OF[w] for w in level]) for level in self.level_winners)
+        self._snapshot = (key, data)
+        return data
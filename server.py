@@ -1,168 +1,708 @@
+import argparse
 import json
+import secrets
 import socket
+import struct
+import sys
 import threading
-from typing import Dict, Optional, List
+import time
+from typing import Dict, Optional, List, Sequence, Tuple
 
-from common import UltimateBoard
+import solver
+from store import StoreError
+from common import MARK_OF, MARKS, MAX_PLAYERS, UltimateBoard, mark_id
+from timers import Timer, TimerWheel, off_wheel, shared_wheel
 
 HOST = "0.0.0.0"
 PORT = 8765
 
+# inbound limits, per connection
+MAX_LINE = 8 * 1024  # longest message we'll buffer before giving up on the client
+# message type -> (tokens per second, burst)
+RATE_LIMITS = {
+    "hello": (1.0, 3),
+    "move": (5.0, 10),
+    "shutdown": (1.0, 2),
+    "*": (10.0, 20),  # anything else
+}
+# how often coalesced broadcasts (e.g. name changes) go out
+TICK = 0.1
+# how long one send may block on a client that stopped reading before we drop it
+SEND_TIMEOUT = 5.0
+
+ENGINES = ("table", "lines")
+# what happens when a player's clock runs out
+TIMEOUT_POLICIES = ("forfeit", "skip")
+
+
+def encode(payload: Dict) -> bytes:
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
 
 def send(sock: socket.socket, payload: Dict):
+    send_raw(sock, encode(payload))
+
+
+def send_raw(sock: socket.socket, data: bytes):
     try:
-        data = (json.dumps(payload) + "\n").encode("utf-8")
         sock.sendall(data)
     except OSError:
         pass
 
 
-def recv_line(sock: socket.socket) -> Optional[Dict]:
-    buf = b""
+def set_send_timeout(sock: socket.socket, seconds: float = SEND_TIMEOUT):
+    """
+    Make sendall() fail with OSError after seconds stuck on a full send buffer,
+    instead of blocking forever. recv() stays blocking (SO_SNDTIMEO, not settimeout).
+    """
+    if sys.platform == "win32":
+        value = struct.pack("I", int(seconds * 1000))
+    else:
+        value = struct.pack("ll", int(seconds), int(seconds % 1 * 1000000))
     try:
-        while True:
-            chunk = sock.recv(1)
-            if not chunk:
-                return None
-            if chunk == b"\n":
-                try:
-                    return json.loads(buf.decode("utf-8"))
-                except json.JSONDecodeError:
-                    return None
-            buf += chunk
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
     except OSError:
-        return None
+        pass
+
+
+class LineReader:
+    """
+    Buffered newline-delimited JSON reader for one socket.
+    Reads in chunks, but never holds more than max_line bytes of an unfinished
+    line: a client that streams without newlines gets disconnected instead of
+    growing our memory. We only recv() when the caller asks for the next
+    message, so a flooding client is slowed down by TCP, not queued by us.
+    """
+    def __init__(self, sock: socket.socket, max_line: int = MAX_LINE, buf: bytes = b""):
+        self.sock = sock
+        self.max_line = max_line
+        self.buf = buf  # anything already read off the socket (see shard.py)
+
+    def read(self) -> Optional[Dict]:
+        """Next message, or None on disconnect / oversized or malformed line."""
+        try:
+            while True:
+                nl = self.buf.find(b"\n")
+                if nl >= 0:
+                    line, self.buf = self.buf[:nl], self.buf[nl + 1:]
+                    try:
+                        msg = json.loads(line.decode("utf-8"))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        return None
+                    return msg if isinstance(msg, dict) else None
+                if len(self.buf) > self.max_line:
+                    return None
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    return None
+                self.buf += chunk
+        except OSError:
+            return None
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst. allow() spends one token if there is one."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RateLimiter:
+    """One TokenBucket per message type for a single connection."""
+    def __init__(self, limits: Dict[str, tuple] = RATE_LIMITS):
+        self.limits = limits
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def allow(self, mtype: str) -> bool:
+        key = mtype if mtype in self.limits else "*"
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*self.limits[key])
+        return bucket.allow()
+
+
+# --------------------------------------------------
+# room membership
+# --------------------------------------------------
+SPECTATOR = "SPECTATOR"
+
+
+class Member:
+    __slots__ = ("sock", "role", "name")
+
+    def __init__(self, sock: socket.socket, role: str):
+        self.sock = sock
+        self.role = role
+        self.name = ""
+
+
+class Membership:
+    """
+    Who was in the room at one moment. Never changed after it is built, so it
+    can be iterated without a lock while people keep joining and leaving.
+    """
+    __slots__ = ("players", "spectators", "player_names", "spectator_names")
+
+    def __init__(self, players: Tuple[Tuple[str, socket.socket], ...], spectators: Tuple[socket.socket, ...],
+                 player_names: Dict[str, str], spectator_names: Tuple[str, ...]):
+        self.players = players  # (mark, socket) in seat order
+        self.spectators = spectators
+        self.player_names = player_names  # mark -> name, for seats that have one
+        self.spectator_names = spectator_names
+
+    @property
+    def sockets(self) -> Tuple[socket.socket, ...]:
+        return tuple(sock for _, sock in self.players) + self.spectators
+
+
+class ConnectionRegistry:
+    """
+    Seats and spectators of one room, safe to use from any thread.
+    Joins, leaves and renames take a short lock and cost O(1); they only mark
+    the current Membership stale. snapshot() rebuilds it on first use after a
+    change, so broadcasts get a stable view and iterate it with no lock held.
+    Once close_seats() is called (the game has started) newcomers only ever
+    watch; a freed seat can then only be retaken with take_seat().
+    """
+    def __init__(self, seats: Sequence[str], max_spectators: int):
+        self.seats = tuple(seats)
+        self.max_spectators = max_spectators
+        self.seats_open = True
+        self.lock = threading.Lock()
+        self.seated: Dict[str, Member] = {}  # mark -> member
+        self.watching: Dict[socket.socket, Member] = {}  # insertion-ordered spectators
+        self.members: Dict[socket.socket, Member] = {}
+        self._snapshot: Optional[Membership] = None
+
+    def add(self, sock: socket.socket) -> Optional[str]:
+        """Seat sock in the first free seat, else as a spectator; None if the room is full."""
+        with self.lock:
+            if self.seats_open and len(self.seated) < len(self.seats):
+                role = next(m for m in self.seats if m not in self.seated)
+                member = self.seated[role] = Member(sock, role)
+            elif len(self.watching) < self.max_spectators:
+                member = self.watching[sock] = Member(sock, SPECTATOR)
+            else:
+                return None
+            self.members[sock] = member
+            self._snapshot = None
+            return member.role
+
+    def remove(self, sock: socket.socket) -> Optional[str]:
+        """Take sock out of the room (frees its seat); its role, or None if it wasn't in."""
+        with self.lock:
+            member = self.members.pop(sock, None)
+            if member is None:
+                return None
+            if member.role == SPECTATOR:
+                del self.watching[sock]
+            else:
+                del self.seated[member.role]
+            self._snapshot = None
+            return member.role
+
+    def close_seats(self):
+        with self.lock:
+            self.seats_open = False
+
+    def take_seat(self, sock: socket.socket, mark: str) -> bool:
+        """Move spectator sock into the free seat mark."""
+        with self.lock:
+            member = self.watching.get(sock)
+            if member is None or mark not in self.seats or mark in self.seated:
+                return False
+            del self.watching[sock]
+            member.role = mark
+            self.seated[mark] = member
+            self._snapshot = None
+            return True
+
+    def rename(self, sock: socket.socket, name: str):
+        with self.lock:
+            member = self.members.get(sock)
+            if member is not None and member.name != name:
+                member.name = name
+                self._snapshot = None
+
+    def clear(self) -> Membership:
+        """Empty the room; everyone who was in it."""
+        with self.lock:
+            snap = self._build()
+            self.seated.clear()
+            self.watching.clear()
+            self.members.clear()
+            self._snapshot = None
+            return snap
+
+    def snapshot(self) -> Membership:
+        snap = self._snapshot
+        if snap is None:
+            with self.lock:
+                snap = self._snapshot
+                if snap is None:
+                    snap = self._snapshot = self._build()
+        return snap
+
+    def _build(self) -> Membership:
+        seated = [self.seated[m] for m in self.seats if m in self.seated]
+        return Membership(
+            tuple((m.role, m.sock) for m in seated),
+            tuple(self.watching),
+            {m.role: m.name for m in seated if m.name},
+            tuple(m.name for m in self.watching.values() if m.name),
+        )
+
+    @property
+    def seats_taken(self) -> int:
+        return len(self.snapshot().players)
 
 
 class GameServer:
     """
     Host-side server.
-    required_players: 2 or 3
-    players: X,O,(Z)
+    required_players: 2..MAX_PLAYERS
+    side/depth/win_rule/reset_on_tie: board configuration, sent to clients in "assign"
+    max_spectators: late joiners beyond this are turned away
+    engine: "table" (3x3 lookup table, see common.small_table) or "lines" (plain line scans)
+    turn_time/increment: Fischer clock per player in seconds (turn_time=0 means no clock)
+    timeout_policy: "forfeit" (out of the game; last one standing wins) or
+                    "skip" (turn passes, clock refilled to turn_time)
+    idle_timeout: drop connections that send nothing for this long (0 = never)
+    wheel: timers for clocks/timeouts/coalesced broadcasts; all rooms share one by default
+    rate_limits: per-connection inbound limits, see RATE_LIMITS
+    capture: capture.Capture to record all traffic to (see capture.py), or None
+    store: store.Store for accounts and ratings (see store.py), or None
+    solver_budget: seconds the endgame solver may spend after each move (0 = off, the
+                   default: it is CPU-bound, so every room in the process pays for it);
+                   a forced result goes out as "forecast" in "state", and the host
+                   can then end the game with {"type": "end_forced"}
+    players: X,O,(Z,...) - see common.MARKS
     late joiners -> spectators
+    seat tokens: a player's "assign" carries a "seat_token". Whoever leaves a
+    started game can take their seat back by sending it in "hello"
+    ({"type": "hello", "name": ..., "seat_token": ...}).
 
     EXTRA: if the HOST (first player, "X") sends {"type": "shutdown"},
     we broadcast "shutdown" to EVERYONE and stop.
     """
-    def __init__(self, required_players: int = 2):
-        assert required_players in (2, 3)
+    def __init__(self, required_players: int = 2, side: int = 3, depth: int = 2,
+                 win_rule: str = "adjacent-2", reset_on_tie: bool = False,
+                 max_spectators: int = 32, engine: str = "table",
+                 turn_time: float = 0.0, increment: float = 0.0, timeout_policy: str = "forfeit",
+                 idle_timeout: float = 600.0, wheel: Optional[TimerWheel] = None,
+                 rate_limits: Dict[str, tuple] = RATE_LIMITS, capture=None,
+                 solver_budget: float = 0.0, store=None):
+        assert 2 <= required_players <= MAX_PLAYERS
+        assert engine in ENGINES
+        assert timeout_policy in TIMEOUT_POLICIES
         self.required_players = required_players
-        self.player_order: List[str] = ["X", "O"] if required_players == 2 else ["X", "O", "Z"]
+        self.player_order: List[str] = list(MARKS[:required_players])
+        self.max_spectators = max_spectators
 
-        self.board = UltimateBoard()
+        self.board = UltimateBoard(reset_on_tie=reset_on_tie, win_rule=win_rule, side=side, depth=depth,
+                                   use_table=engine == "table")
         self.lock = threading.Lock()
 
-        # mark -> socket
-        self.players: Dict[str, socket.socket] = {}
-        # mark -> username
-        self.player_names: Dict[str, str] = {}
+        # seats (mark -> connection), spectators and their names
+        self.members = ConnectionRegistry(self.player_order, max_spectators)
 
-        # spectators
-        self.spectators: List[socket.socket] = []
-        self.spectator_names: Dict[int, str] = {}  # id(sock) -> name
+        # mark -> seq of the last move we processed from that player
+        # (clients use this to reconcile their predicted moves)
+        self.move_acks: Dict[str, int] = {}
 
         self.turn_index: int = 0
         self.running = True
 
+        self.wheel = wheel or shared_wheel()
+
+        # set when something changed that can wait for the next tick (see request_broadcast)
+        self.broadcast_pending = False
+        # held while a state is built and sent, so states go out in the order
+        # they were built (a slow broadcast can't be overtaken by a newer one)
+        self.broadcast_lock = threading.Lock()
+
+        # turn clocks: mark -> seconds left (empty when there's no clock)
+        self.turn_time = turn_time
+        self.increment = increment
+        self.timeout_policy = timeout_policy
+        self.clocks: Dict[str, float] = {m: turn_time for m in self.player_order} if turn_time > 0 else {}
+        self.turn_started = 0.0
+        self.turn_timer: Optional[Timer] = None
+        self.turn_serial = 0  # bumped per turn, so a late timer for an old turn is ignored
+        self.forfeited: List[str] = []
+        self.idle_timeout = idle_timeout
+        self.rate_limits = rate_limits
+
+        # what the solver says the game will end as, e.g. {"result": "win", "winner": "X"}
+        self.solver_budget = solver_budget
+        self.forecast: Optional[Dict] = None
+
+        # accounts and ratings; the result is queued to the store once, when the game ends
+        self.store = store
+        self.accounts: Dict[str, str] = {}  # mark -> account name of whoever logged in to that seat
+        # mark -> secret sent with that seat's "assign"; whoever knows it can take the seat back
+        self.seat_tokens: Dict[str, str] = {}
+        # mark -> account (None for a guest) of a player who left mid-game; the seat
+        # stays theirs until they come back with its token
+        self.held: Dict[str, Optional[str]] = {}
+        self.moves_played = 0
+        self.result_recorded = False
+        # set once every seat has been filled; seats aren't given out after that
+        self.started = False
+
+        self.capture = capture
+        if capture is not None:
+            # enough to rebuild this room for a replay
+            capture.write_meta({
+                "required_players": required_players, "side": side, "depth": depth,
+                "win_rule": win_rule, "reset_on_tie": reset_on_tie, "max_spectators": max_spectators,
+                "engine": engine, "turn_time": turn_time, "increment": increment,
+                "timeout_policy": timeout_policy, "idle_timeout": idle_timeout,
+                "solver_budget": solver_budget,
+            })
+
     @property
     def current_turn(self) -> str:
         return self.player_order[self.turn_index]
 
     def next_turn(self):
-        self.turn_index = (self.turn_index + 1) % len(self.player_order)
+        for _ in range(len(self.player_order)):
+            self.turn_index = (self.turn_index + 1) % len(self.player_order)
+            if self.current_turn not in self.forfeited:
+                break
+
+    # --------------------------------------------------
+    # turn clocks (call with self.lock held)
+    # --------------------------------------------------
+    def start_turn_clock(self):
+        if not self.clocks or self.board.macro_winner or self.board.macro_tied:
+            return
+        self.wheel.cancel(self.turn_timer)
+        self.turn_serial += 1
+        self.turn_started = time.monotonic()
+        # every room shares the wheel thread: the timeout (which takes self.lock
+        # and broadcasts) runs on a thread of its own
+        self.turn_timer = self.wheel.schedule(self.clocks[self.current_turn], off_wheel,
+                                              self.on_turn_timeout, self.turn_serial)
+
+    def stop_turn_clock(self, mark: str):
+        """mark just moved: charge the time used and add the increment."""
+        if not self.clocks:
+            return
+        self.wheel.cancel(self.turn_timer)
+        self.turn_timer = None
+        used = time.monotonic() - self.turn_started
+        self.clocks[mark] = max(0.0, self.clocks[mark] - used) + self.increment
+
+    def clock_snapshot(self) -> Dict[str, float]:
+        clocks = dict(self.clocks)
+        if self.turn_timer is not None:
+            mark = self.current_turn
+            clocks[mark] = max(0.0, clocks[mark] - (time.monotonic() - self.turn_started))
+        return {m: round(t, 2) for m, t in clocks.items()}
+
+    def on_turn_timeout(self, serial: int):
+        with self.lock:
+            if serial != self.turn_serial or not self.running:
+                return
+            self.turn_timer = None
+            if self.capture is not None:
+                self.capture.write_timeout(self._position())
+            mark = self.current_turn
+            # the forecast assumed this player would move (and stay in the game)
+            self.forecast = None
+            if self.timeout_policy == "skip":
+                self.clocks[mark] = self.turn_time
+                self.next_turn()
+            else:
+                self.clocks[mark] = 0.0
+                self.forfeited.append(mark)
+                left = [m for m in self.player_order if m not in self.forfeited]
+                if len(left) == 1:
+                    self.board.macro_winner = mark_id(left[0])
+                    self.record_result()
+                else:
+                    self.next_turn()
+            print(f"[SERVER] {mark} ran out of time ({self.timeout_policy})")
+            self.start_turn_clock()
+        self.broadcast_state()
+
+    def on_idle(self, sock: socket.socket):
+        send(sock, {"type": "error", "message": "Idle timeout"})
+        try:
+            # wakes the handler thread blocked in recv
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # --------------------------------------------------
+    # early result detection
+    # --------------------------------------------------
+    def check_forecast(self):
+        """
+        Run the endgame solver on the current position (call after the move's
+        broadcast, without the lock). Solving happens on a copy, so moves aren't
+        held up, and the answer is dropped if the board moved on meanwhile.
+        """
+        if self.solver_budget <= 0:
+            return
+        with self.lock:
+            board = self.board
+            # the solver doesn't know about forfeited seats
+            if board.macro_winner or board.macro_tied or self.forfeited:
+                return
+            board = board.copy()
+            turn = mark_id(self.current_turn)
+            position = self._position()
+        result = solver.solve(board, turn, self.required_players, self.solver_budget)
+        with self.lock:
+            if self._position() != position or result == self.forecast:
+                return
+            self.forecast = result
+        if result:
+            print(f"[SERVER] result is forced: {result}")
+        self.broadcast_state()
+
+    def _position(self) -> tuple:
+        """Changes whenever the board, the player to move or the seats in play do."""
+        return self.board.version, self.turn_index, len(self.forfeited)
+
+    def end_forced(self) -> bool:
+        """Finish the game with the forecast result (host's call). Call with self.lock held."""
+        if not self.forecast or self.board.macro_winner or self.board.macro_tied:
+            return False
+        if self.forecast["result"] == "win":
+            self.board.macro_winner = mark_id(self.forecast["winner"])
+        else:
+            self.board.macro_tied = True
+        self.wheel.cancel(self.turn_timer)
+        self.turn_timer = None
+        self.record_result()
+        return True
+
+    # --------------------------------------------------
+    # results
+    # --------------------------------------------------
+    def reclaim_seat(self, sock: socket.socket, token: str) -> str:
+        """A spectator holding the token of a seat left mid-game gets it back; their role."""
+        with self.lock:
+            mark = next((m for m in self.held if secrets.compare_digest(self.seat_tokens[m], token)), None)
+            if mark is None or not self.members.take_seat(sock, mark):
+                return SPECTATOR
+            account = self.held.pop(mark)
+            if account is not None:
+                self.accounts[mark] = account
+            # the new connection numbers its moves from 1 again
+            self.move_acks.pop(mark, None)
+        print(f"[SERVER] {account or 'guest'} is back as {mark}")
+        self.send_assign(sock, mark)
+        self.request_broadcast()
+        return mark
+
+    def record_result(self):
+        """Queue the finished game to the store (call with self.lock held). Never waits on disk."""
+        if self.store is None or self.result_recorded:
+            return
+        if not self.board.macro_winner and not self.board.macro_tied:
+            return
+        self.result_recorded = True
+        winner = MARK_OF[self.board.macro_winner] if self.board.macro_winner else None
+        try:
+            self.store.record_game({m: self.accounts.get(m) for m in self.player_order}, winner,
+                                   self.moves_played)
+        except StoreError as e:
+            print(f"[SERVER] result not recorded: {e}")
 
     # --------------------------------------------------
     # broadcast helpers
     # --------------------------------------------------
     def broadcast_state(self):
+        with self.broadcast_lock:
+            self._broadcast_state()
+
+    def _broadcast_state(self):
+        members = self.members.snapshot()
+        # the board is only changed under self.lock; reading it (and caching its
+        # serialize() snapshot) without the lock could catch half a move
+        with self.lock:
+            state = self._state(members)
+        # encoded once; every subscriber gets the same bytes object, which lets
+        # wrappers like ws_gateway's reuse their framing of it too
+        data = encode(state)
+
+        # players, then spectators. Whoever can't be reached (or stopped reading,
+        # see set_send_timeout) is cut off; their handler then leaves the room for them
+        for sock in members.sockets:
+            try:
+                sock.sendall(data)
+            except OSError:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _state(self, members: Membership) -> Dict:
+        """The "state" message (call with self.lock held)."""
         state = {
             "type": "state",
             "turn": self.current_turn,
             "board": self.board.serialize(),
             "required_players": self.required_players,
-            "connected_players": len(self.players),
-            "players": list(self.players.keys()),
-            "player_names": self.player_names,
-            "spectator_names": list(self.spectator_names.values()),
+            "connected_players": len(members.players),
+            "players": [mark for mark, _ in members.players],
+            "player_names": members.player_names,
+            "spectator_names": list(members.spectator_names),
+            "acks": dict(self.move_acks),
+            # every seat has been filled once; moves are accepted from now on,
+            # even while a player who left is away
+            "started": self.started,
         }
-
-        # players
-        dead_players = []
-        for mark, sock in self.players.items():
-            try:
-                send(sock, state)
-            except OSError:
-                dead_players.append(mark)
-        for mark in dead_players:
-            if mark in self.player_names:
-                del self.player_names[mark]
-            del self.players[mark]
-
-        # spectators
-        alive_specs = []
-        for s in self.spectators:
-            try:
-                send(s, state)
-                alive_specs.append(s)
-            except OSError:
-                sid = id(s)
-                if sid in self.spectator_names:
-                    del self.spectator_names[sid]
-        self.spectators = alive_specs
+        if self.clocks:
+            state["clocks"] = self.clock_snapshot()
+            state["forfeited"] = list(self.forfeited)
+        if self.forecast:
+            state["forecast"] = self.forecast
+        return state
+
+    def request_broadcast(self):
+        """Broadcast on the next tick; any number of requests before then cost one broadcast."""
+        if not self.broadcast_pending:
+            self.broadcast_pending = True
+            self.wheel.schedule(TICK, off_wheel, self.flush_broadcast)
+
+    def flush_broadcast(self):
+        if self.broadcast_pending:
+            self.broadcast_pending = False
+            self.broadcast_state()
 
     def broadcast_shutdown(self):
-        payload = {"type": "shutdown"}
-        # to players
-        for sock in list(self.players.values()):
-            send(sock, payload)
-            try:
-                sock.close()
-            except:
-                pass
-        # to spectators
-        for sock in list(self.spectators):
-            send(sock, payload)
+        data = encode({"type": "shutdown"})
+        # to players, then spectators
+        for sock in self.members.clear().sockets:
+            send_raw(sock, data)
             try:
                 sock.close()
             except:
                 pass
 
-        self.players.clear()
-        self.spectators.clear()
-
     # --------------------------------------------------
     # client handler
     # --------------------------------------------------
-    def handle_client(self, sock: socket.socket, role: str):
+    def send_assign(self, sock: socket.socket, role: str):
+        members = self.members.snapshot()
         # tell client what they are
-        send(sock, {
+        assign = {
             "type": "assign",
             "you_are": role,
             "required_players": self.required_players,
-            "connected_players": len(self.players),
-            "player_names": self.player_names,
-            "spectator_names": list(self.spectator_names.values()),
-        })
+            "connected_players": len(members.players),
+            "player_names": members.player_names,
+            "spectator_names": list(members.spectator_names),
+            # board configuration: the client builds its mirror/layout from this
+            "side": self.board.config.side,
+            "depth": self.board.config.depth,
+            "win_rule": self.board.win_rule,
+            "reset_on_tie": self.board.reset_on_tie,
+        }
+        if role in self.seat_tokens:
+            # only ever sent to this connection: it is what proves the seat is theirs
+            assign["seat_token"] = self.seat_tokens[role]
+        send(sock, assign)
+
+    def handle_client(self, sock: socket.socket, role: str, pending: bytes = b""):
+        self.send_assign(sock, role)
         self.broadcast_state()
 
+        reader = LineReader(sock, buf=pending)
+        limiter = RateLimiter(self.rate_limits)
+        idle_timer = None
         try:
             while self.running:
-                msg = recv_line(sock)
+                if self.idle_timeout > 0:
+                    self.wheel.cancel(idle_timer)
+                    idle_timer = self.wheel.schedule(self.idle_timeout, off_wheel, self.on_idle, sock)
+                msg = reader.read()
                 if msg is None:
                     break
 
                 mtype = msg.get("type")
 
+                if not limiter.allow(mtype):
+                    # over the limit: drop it. moves get an error so the client can roll back.
+                    if mtype == "move":
+                        send(sock, {"type": "error", "message": "Slow down",
+                                    "seq": int(msg.get("seq", 0))})
+                    # a quick rename isn't lost, only its login: the name is kept and
+                    # the broadcast is coalesced like any other
+                    elif mtype == "hello":
+                        name = str(msg.get("name", "")).strip()[:32]
+                        if name:
+                            self.members.rename(sock, name)
+                            self.request_broadcast()
+                    continue
+
                 # client introduces themselves
                 if mtype == "hello":
-                    name = msg.get("name", "").strip()
-                    if role in self.player_order:
-                        if name:
-                            self.player_names[role] = name
+                    name = str(msg.get("name", "")).strip()[:32]
+                    token = msg.get("seat_token")
+                    if role == SPECTATOR and token:
+                        role = self.reclaim_seat(sock, str(token))
+                    if name and self.store is not None:
+                        try:
+                            account = self.store.login(name, msg.get("password") or None)
+                        except StoreError as e:
+                            # play on as a guest
+                            print(f"[SERVER] login failed: {e}")
+                            account = {}
+                        if account is None:
+                            send(sock, {"type": "error", "message": f"Wrong password for {name}"})
+                            continue
+                        if account:
+                            if role in self.player_order:
+                                with self.lock:
+                                    self.accounts[role] = account["name"]
+                            send(sock, {"type": "account", **account})
+                    if name:
+                        self.members.rename(sock, name)
+                    # name changes are coalesced into at most one broadcast per tick
+                    self.request_broadcast()
+                    continue
+
+                # keepalive: only resets the idle timer
+                if mtype == "ping":
+                    continue
+
+                if mtype == "leaderboard":
+                    if self.store is None:
+                        send(sock, {"type": "error", "message": "No accounts on this server"})
                     else:
-                        if name:
-                            self.spectator_names[id(sock)] = name
-                    self.broadcast_state()
+                        try:
+                            send(sock, {"type": "leaderboard", "rows": self.store.leaderboard()})
+                        except StoreError as e:
+                            send(sock, {"type": "error", "message": "Leaderboard unavailable"})
+                            print(f"[SERVER] leaderboard failed: {e}")
+                    continue
+
+                # host accepts the solver's forced result instead of playing it out
+                if mtype == "end_forced":
+                    if role != self.player_order[0]:
+                        send(sock, {"type": "error", "message": "Only host can end the game"})
+                        continue
+                    with self.lock:
+                        ended = self.end_forced()
+                    if ended:
+                        self.broadcast_state()
                     continue
 
                 # host says "shutdown" -> kill room
@@ -184,30 +724,57 @@ class GameServer:
                         continue
 
                     # don't accept moves until all required are in
-                    if len(self.players) < self.required_players:
-                        send(sock, {"type": "error", "message": "Waiting for more players"})
+                    if not self.started:
+                        send(sock, {"type": "error", "message": "Waiting for more players",
+                                    "seq": int(msg.get("seq", 0))})
                         continue
 
                     big = int(msg.get("big", -1))
                     small = int(msg.get("small", -1))
+                    seq = int(msg.get("seq", 0))
 
+                    error = None
                     with self.lock:
+                        if seq:
+                            self.move_acks[role] = seq
                         if role != self.current_turn:
-                            send(sock, {"type": "error", "message": "Not your turn"})
-                            continue
-
-                        ok = self.board.apply(self.current_turn, (big, small))
-                        if not ok:
-                            send(sock, {"type": "error", "message": "Illegal move"})
-                            continue
-
-                        # advance turn if game not over
-                        if not self.board.macro_winner and not self.board.macro_tied:
-                            self.next_turn()
+                            error = "Not your turn"
+                        elif not self.board.apply(mark_id(self.current_turn), (big, small)):
+                            error = "Illegal move"
+                        else:
+                            self.moves_played += 1
+
+                            # advance turn if game not over
+                            self.stop_turn_clock(role)
+                            if not self.board.macro_winner and not self.board.macro_tied:
+                                self.next_turn()
+                                self.start_turn_clock()
+                            else:
+                                self.record_result()
+
+                    # sent after letting go of the lock: a send can block for up to
+                    # SEND_TIMEOUT, and the turn clocks need the lock meanwhile
+                    if error:
+                        send(sock, {"type": "error", "message": error, "seq": seq})
+                        continue
 
                     self.broadcast_state()
+                    # after the broadcast, so the solver never delays it
+                    self.check_forecast()
 
         finally:
+            self.wheel.cancel(idle_timer)
+            # frees the seat; the others hear about it on the next tick
+            left = self.members.remove(sock)
+            if left is not None and left != SPECTATOR:
+                with self.lock:
+                    # whoever sits here next isn't them: once the game is on, the
+                    # seat waits for whoever has its token
+                    name = self.accounts.pop(left, None)
+                    if self.started:
+                        self.held[left] = name
+            if left is not None and self.running:
+                self.request_broadcast()
             try:
                 sock.close()
             except:
@@ -223,29 +790,130 @@ class GameServer:
             except OSError:
                 break
             print(f"[SERVER] connection from {addr}")
-
-            # choose role
-            if len(self.players) < self.required_players:
-                role = self.player_order[len(self.players)]
-                self.players[role] = client
-                print(f"[SERVER] assigned {role}")
-            else:
-                role = "SPECTATOR"
-                self.spectators.append(client)
-                print("[SERVER] assigned SPECTATOR")
-
-            t = threading.Thread(target=self.handle_client, args=(client, role), daemon=True)
-            t.start()
-
-    def run(self):
+            self.join(client)
+
+    def join(self, client: socket.socket, pending: bytes = b"") -> Optional[str]:
+        """
+        Give a new connection a seat (or a spectator spot) and start its handler thread.
+        pending: bytes already read from client by someone else (the shard router)
+        """
+        set_send_timeout(client)
+        if self.capture is not None:
+            client = self.capture.wrap(client)
+        # choose role: first free seat, else spectator
+        role = self.members.add(client)
+        if role is None:
+            send(client, {"type": "error", "message": "Room is full"})
+            try:
+                client.close()
+            except OSError:
+                pass
+            print("[SERVER] room full, turned away")
+            return None
+        print(f"[SERVER] assigned {role}")
+
+        # last seat filled: the game starts, the first player's clock with it, and
+        # from now on a seat that is left can only be taken back with its token
+        if role != SPECTATOR:
+            with self.lock:
+                self.seat_tokens[role] = secrets.token_urlsafe(16)
+        if role != SPECTATOR and self.members.seats_taken == self.required_players:
+            self.members.close_seats()
+            with self.lock:
+                if not self.started:
+                    self.started = True
+                    self.start_turn_clock()
+
+        t = threading.Thread(target=self.handle_client, args=(client, role, pending), daemon=True)
+        t.start()
+        return role
+
+    def run(self, host: str = HOST, port: int = PORT):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server.bind((HOST, PORT))
-            server.listen(5)
-            print(f"[SERVER] Listening on {HOST}:{PORT}")
+            server.bind((host, port))
+            server.listen(64)
+            host, port = server.getsockname()[:2]
+            print(f"[SERVER] Listening on {host}:{port}", flush=True)
             self.accept_loop(server)
 
 
+# --------------------------------------------------
+# headless entry point (never imports pygame)
+# --------------------------------------------------
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Ultimate Tic-Tac-Toe server (headless)")
+    p.add_argument("--host", default=HOST)
+    p.add_argument("--port", type=int, default=PORT, help="0 picks a free port")
+    p.add_argument("--players", type=int, default=2, choices=range(2, MAX_PLAYERS + 1), metavar="N",
+                   help=f"seats per room (2..{MAX_PLAYERS})")
+    p.add_argument("--max-spectators", type=int, default=32, help="spectators per room")
+    p.add_argument("--side", type=int, default=3, help="board side (3 = classic)")
+    p.add_argument("--depth", type=int, default=2, help="nesting depth (2 = classic ultimate)")
+    p.add_argument("--win-rule", default="adjacent-2", choices=["adjacent-2", "three-in-row"])
+    p.add_argument("--reset-on-tie", action="store_true", help="clear tied small boards instead of killing them")
+    p.add_argument("--engine", default="table", choices=ENGINES,
+                   help="table: 3x3 lookup table (built once, cached on disk); lines: plain line scans")
+    p.add_argument("--turn-time", type=float, default=0.0, help="seconds on each player's clock (0 = no clock)")
+    p.add_argument("--increment", type=float, default=0.0, help="seconds added to a player's clock per move")
+    p.add_argument("--timeout-policy", default="forfeit", choices=TIMEOUT_POLICIES)
+    p.add_argument("--idle-timeout", type=float, default=600.0, help="drop silent connections after this (0 = never)")
+    p.add_argument("--capture", metavar="PATH", help="append all traffic to this file (replay with capture.py)")
+    p.add_argument("--workers", type=int, default=0,
+                   help="fork this many processes and shard rooms across them by room code (see shard.py)")
+    p.add_argument("--stats", action="store_true", help="with --workers: print per-worker stats")
+    p.add_argument("--solver-budget", type=float, default=0.0,
+                   help="seconds of CPU per move for detecting forced results early "
+                        f"(0 = off; {solver.DEFAULT_BUDGET} is a sensible budget)")
+    p.add_argument("--ws-port", type=int, default=None,
+                   help="also accept browser (WebSocket) players on this port (see ws_gateway.py)")
+    p.add_argument("--db", metavar="PATH", help="SQLite file for accounts, results and ratings (see store.py)")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    settings = dict(required_players=args.players, side=args.side, depth=args.depth,
+                    win_rule=args.win_rule, reset_on_tie=args.reset_on_tie,
+                    max_spectators=args.max_spectators, engine=args.engine,
+                    turn_time=args.turn_time, increment=args.increment,
+                    timeout_policy=args.timeout_policy, idle_timeout=args.idle_timeout,
+                    solver_budget=args.solver_budget)
+    if args.workers > 0:
+        if args.capture:
+            raise SystemExit("--capture records a single room; it can't be used with --workers")
+        if args.ws_port is not None:
+            raise SystemExit("--ws-port attaches to this process's room; it can't be used with --workers")
+        from shard import Router
+        Router(args.workers, settings, stats=args.stats, db=args.db).run(args.host, args.port)
+        return
+
+    capture = None
+    if args.capture:
+        from capture import Capture
+        try:
+            capture = Capture(args.capture)
+        except FileExistsError:
+            raise SystemExit(f"{args.capture} already exists; captures hold one server run each")
+    store = None
+    if args.db:
+        from store import Store
+        store = Store(args.db)
+    gs = GameServer(capture=capture, store=store, **settings)
+    if args.ws_port is not None:
+        from ws_gateway import WebSocketGateway
+        WebSocketGateway(lambda room: gs).start(args.host, args.ws_port)
+    try:
+        gs.run(args.host, args.port)
+    except KeyboardInterrupt:
+        gs.running = False
+        gs.broadcast_shutdown()
+    finally:
+        if capture is not None:
+            capture.close()
+        if store is not None:
+            store.close()
+
+
 if __name__ == "__main__":
-    gs = GameServer(2)
-    gs.run()
+    main()
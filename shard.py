@@ -0,0 +1,364 @@
+"""
+Multi-process room sharding behind one listening port.
+
+    python server.py --workers 4
+
+One GameServer is stuck on one core (GIL), so this mode forks N worker
+processes that each own a share of the rooms, with a small router in front:
+
+  router:  accepts on the port, reads the client's first line (the "hello",
+           which may carry {"room": "<code>"}), picks the worker that owns the
+           room (crc32 of the code, mod N) and hands the connection's file
+           descriptor to it over a Unix socket (SCM_RIGHTS), together with the
+           bytes it already read. It never touches the game after that.
+  worker:  a RoomServer with one GameServer per room code, created on first
+           join and dropped once its host has shut it down, or once nobody
+           has sat in it for a sweep or two (SWEEP_INTERVAL; spectators alone
+           don't keep a room open). At most MAX_ROOMS rooms per worker; joins
+           that would open another are turned away. Rooms in one worker share
+           that worker's timer wheel.
+
+Clients that don't send anything first (older clients wait for "assign") are
+routed to the default room "" after ROUTE_TIMEOUT.
+
+Shutdown: a host's {"type": "shutdown"} ends their room, exactly as with a
+single GameServer. Ctrl-C / SIGTERM on the router sends "shutdown" to every
+connection in every worker, then the workers exit.
+
+With --db every worker opens the database itself (SQLite in WAL mode copes
+with several writer processes; each one batches its writes, see store.py).
+
+Workers report stats (rooms, connections, joins) to the router every
+STATS_INTERVAL seconds; pass --stats to have the router print them.
+
+Unix only (fork + SCM_RIGHTS).
+"""
+
+import json
+import multiprocessing
+import selectors
+import signal
+import socket
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from server import HOST, MAX_LINE, PORT, GameServer, send
+from timers import TimerWheel, off_wheel
+
+# how long the router waits for a first line before using the default room
+ROUTE_TIMEOUT = 0.5
+STATS_INTERVAL = 5.0
+# a room with no players at two sweeps in a row is closed
+SWEEP_INTERVAL = 30.0
+MAX_ROOMS = 256  # per worker
+# one control message: a JSON header line, then (for joins) the bytes already read
+CONTROL_MAX = MAX_LINE + 8192
+ROOM_MAX = 32
+
+
+def room_of(first: bytes) -> str:
+    """Room code from the client's first line ("" if there is none)."""
+    try:
+        msg = json.loads(first.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return ""
+    if not isinstance(msg, dict):
+        return ""
+    return str(msg.get("room", "")).strip()[:ROOM_MAX]
+
+
+def worker_for(room: str, workers: int) -> int:
+    return zlib.crc32(room.encode("utf-8")) % workers
+
+
+# -----------------------------------------------------
+# worker side
+# -----------------------------------------------------
+class RoomServer:
+    """All the rooms of one worker process."""
+    def __init__(self, index: int, ctrl: socket.socket, settings: Dict, db: Optional[str] = None):
+        self.index = index
+        self.ctrl = ctrl
+        self.settings = settings
+        self.store = None
+        if db:
+            from store import Store
+            self.store = Store(db)
+        self.rooms: Dict[str, GameServer] = {}
+        self.unused: Dict[str, GameServer] = {}  # rooms with no players at the last sweep
+        self.lock = threading.Lock()
+        self.wheel = TimerWheel().start()
+        self.joins = 0
+        self.turned_away = 0
+        self.rooms_closed = 0
+        self.running = True
+
+    def room(self, code: str) -> Optional[GameServer]:
+        """The room called code, opened if need be; None if this worker is full."""
+        with self.lock:
+            gs = self.rooms.get(code)
+            if gs is None or not gs.running:
+                if gs is not None:
+                    del self.rooms[code]
+                    self.rooms_closed += 1
+                if len(self.rooms) >= MAX_ROOMS:
+                    return None
+                gs = self.rooms[code] = GameServer(wheel=self.wheel, store=self.store, **self.settings)
+            return gs
+
+    def join(self, code: str, sock: socket.socket, pending: bytes):
+        gs = self.room(code)
+        role = None
+        if gs is None:
+            send(sock, {"type": "error", "message": "Server full"})
+            sock.close()
+        else:
+            role = gs.join(sock, pending)
+        if role is None:
+            self.turned_away += 1
+        else:
+            self.joins += 1
+
+    def sweep(self):
+        """Close rooms that have had no players since the last sweep, and forget closed ones."""
+        if not self.running:
+            return
+        closing = []
+        with self.lock:
+            unused = {}
+            for code, gs in list(self.rooms.items()):
+                if not gs.running:
+                    del self.rooms[code]
+                    self.rooms_closed += 1
+                elif not gs.members.snapshot().players:
+                    if self.unused.get(code) is gs:
+                        del self.rooms[code]
+                        self.rooms_closed += 1
+                        closing.append(gs)
+                    else:
+                        unused[code] = gs
+            self.unused = unused
+        # spectators still watching hear it's over
+        for gs in closing:
+            gs.running = False
+            gs.broadcast_shutdown()
+        self.wheel.schedule(SWEEP_INTERVAL, off_wheel, self.sweep)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            live = [gs for gs in self.rooms.values() if gs.running]
+        members = [gs.members.snapshot() for gs in live]
+        return {
+            "op": "stats",
+            "worker": self.index,
+            "rooms": len(live),
+            "players": sum(len(m.players) for m in members),
+            "spectators": sum(len(m.spectators) for m in members),
+            "joins": self.joins,
+            "turned_away": self.turned_away,
+            "rooms_closed": self.rooms_closed,
+        }
+
+    def report(self):
+        if not self.running:
+            return
+        try:
+            self.ctrl.send(json.dumps(self.stats()).encode("utf-8"))
+        except OSError:
+            return
+        self.wheel.schedule(STATS_INTERVAL, off_wheel, self.report)
+
+    def shutdown(self):
+        self.running = False
+        with self.lock:
+            rooms = list(self.rooms.values())
+        for gs in rooms:
+            gs.running = False
+            gs.broadcast_shutdown()
+        self.wheel.stop()
+        if self.store is not None:
+            self.store.close()
+
+    def serve(self):
+        self.report()
+        self.wheel.schedule(SWEEP_INTERVAL, off_wheel, self.sweep)
+        while self.running:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.ctrl, CONTROL_MAX, 1)
+            except OSError:
+                break
+            if not data:  # router went away
+                break
+            head, _, pending = data.partition(b"\n")
+            msg = json.loads(head)
+            if msg.get("op") == "join" and fds:
+                self.join(msg.get("room", ""), socket.socket(fileno=fds[0]), pending)
+            elif msg.get("op") == "stop":
+                break
+            for fd in fds[1:]:
+                socket.close(fd)
+        self.shutdown()
+
+
+def worker_main(index: int, ctrl: socket.socket, router_ends: List[socket.socket], settings: Dict,
+                db: Optional[str]):
+    # without this a worker would keep its siblings' control sockets open, and
+    # they would never see EOF if the router died
+    for s in router_ends:
+        s.close()
+    # Ctrl-C goes to the whole process group; the router decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    RoomServer(index, ctrl, settings, db).serve()
+
+
+# -----------------------------------------------------
+# router side
+# -----------------------------------------------------
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class Router:
+    """
+    workers: number of worker processes
+    settings: GameServer keyword arguments used for every room
+    stats: print the workers' stats as they come in
+    db: SQLite path for accounts and ratings, opened by each worker (or None)
+    """
+    def __init__(self, workers: int, settings: Dict, stats: bool = False, db: Optional[str] = None):
+        assert workers >= 1
+        self.num_workers = workers
+        self.settings = settings
+        self.db = db
+        self.print_stats = stats
+        self.workers: List[Tuple[multiprocessing.Process, socket.socket]] = []
+        self.worker_stats: Dict[int, Dict] = {}
+        self.sel = selectors.DefaultSelector()
+        # fd -> (socket, bytes so far, deadline) for connections we haven't routed yet
+        self.pending: Dict[int, Tuple[socket.socket, bytes, float]] = {}
+        self.running = True
+
+    def start_workers(self):
+        ctx = multiprocessing.get_context("fork")
+        for i in range(self.num_workers):
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            router_ends = [ctrl for _, ctrl in self.workers] + [ours]
+            p = ctx.Process(target=worker_main, args=(i, theirs, router_ends, self.settings, self.db),
+                            name=f"room-worker-{i}", daemon=True)
+            p.start()
+            theirs.close()
+            self.workers.append((p, ours))
+            self.sel.register(ours, selectors.EVENT_READ, ("worker", i))
+
+    def route(self, sock: socket.socket, data: bytes):
+        """Hand sock (and what we've read from it) to the worker owning its room."""
+        first = data.split(b"\n", 1)[0] if b"\n" in data else b""
+        room = room_of(first)
+        index = worker_for(room, self.num_workers)
+        head = json.dumps({"op": "join", "room": room}).encode("utf-8")
+        try:
+            socket.send_fds(self.workers[index][1], [head + b"\n" + data], [sock.fileno()])
+        except OSError as e:
+            print(f"[ROUTER] worker {index} unreachable: {e!r}")
+        sock.close()  # the worker has its own copy of the fd now
+
+    def _drop_pending(self, fd: int) -> Tuple[socket.socket, bytes, float]:
+        entry = self.pending.pop(fd)
+        self.sel.unregister(entry[0])
+        return entry
+
+    def on_client_data(self, sock: socket.socket):
+        fd = sock.fileno()
+        try:
+            chunk = sock.recv(4096)
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._drop_pending(fd)
+            sock.close()
+            return
+        _, data, deadline = self.pending[fd]
+        data += chunk
+        if b"\n" in data or len(data) > MAX_LINE:
+            self._drop_pending(fd)
+            self.route(sock, data)
+        else:
+            self.pending[fd] = (sock, data, deadline)
+
+    def on_worker_message(self, index: int, ctrl: socket.socket):
+        try:
+            data = ctrl.recv(CONTROL_MAX)
+        except OSError:
+            data = b""
+        if not data:
+            print(f"[ROUTER] worker {index} exited")
+            self.sel.unregister(ctrl)
+            return
+        msg = json.loads(data)
+        if msg.get("op") == "stats":
+            self.worker_stats[index] = msg
+            if self.print_stats:
+                print(f"[ROUTER] worker {index}: rooms={msg['rooms']} players={msg['players']} "
+                      f"spectators={msg['spectators']} joins={msg['joins']}", flush=True)
+
+    def expire_pending(self):
+        now = time.monotonic()
+        for fd in [fd for fd, (_, _, deadline) in self.pending.items() if deadline <= now]:
+            sock, data, _ = self._drop_pending(fd)
+            self.route(sock, data)
+
+    def serve(self, server_sock: socket.socket):
+        server_sock.setblocking(False)
+        self.sel.register(server_sock, selectors.EVENT_READ, ("listen", None))
+        while self.running:
+            for key, _ in self.sel.select(timeout=ROUTE_TIMEOUT / 2):
+                kind, arg = key.data
+                if kind == "listen":
+                    try:
+                        client, addr = server_sock.accept()
+                    except OSError:
+                        continue
+                    client.setblocking(True)
+                    self.pending[client.fileno()] = (client, b"", time.monotonic() + ROUTE_TIMEOUT)
+                    self.sel.register(client, selectors.EVENT_READ, ("client", None))
+                elif kind == "client":
+                    self.on_client_data(key.fileobj)
+                else:
+                    self.on_worker_message(arg, key.fileobj)
+            self.expire_pending()
+
+    def stop(self):
+        """Tell every worker to send "shutdown" to its rooms, then wait for them."""
+        self.running = False
+        for _, ctrl in self.workers:
+            try:
+                ctrl.send(json.dumps({"op": "stop"}).encode("utf-8"))
+            except OSError:
+                pass
+        for p, ctrl in self.workers:
+            p.join(5.0)
+            if p.is_alive():
+                p.terminate()
+            ctrl.close()
+        for sock, _, _ in self.pending.values():
+            sock.close()
+        self.pending.clear()
+
+    def run(self, host: str = HOST, port: int = PORT):
+        self.start_workers()
+        # SIGTERM (e.g. a container stop) shuts down like Ctrl-C
+        signal.signal(signal.SIGTERM, _interrupt)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(256)
+            host, port = server.getsockname()[:2]
+            print(f"[ROUTER] Listening on {host}:{port} with {self.num_workers} workers", flush=True)
+            try:
+                self.serve(server)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stop()
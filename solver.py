@@ -0,0 +1,195 @@
+"""
+Exact endgame solver: is the result already decided?
+
+    from solver import solve
+    solve(board, turn=mark_id("O"), players=2, budget=0.05)
+    # -> {"result": "win", "winner": "X"} / {"result": "draw"} / None
+
+The search is iterative deepening: one more ply per pass until the time
+budget is spent, then it gives up (None), so a call never runs much past its
+budget. That budget is pure CPU under the GIL, though, so the server only runs
+the solver after every move when asked to (--solver-budget).
+
+A win is proved as soon as one line forces it (so a short forced win is
+found even with lots of empty cells, e.g. two open adjacent boards the
+opponent can't both block); a draw or loss needs every reply searched to the
+end, which in practice means positions with few empty cells. Proven
+sub-positions are memoized across calls, so as a game goes on later calls
+mostly hit the memo.
+
+What "forced" means:
+  - 2 players: the game-theoretic value with perfect play (negamax), so a
+    draw means both sides can hold it.
+  - more players: a win is forced if that player wins whatever everyone else
+    does (they are assumed to gang up); a draw is forced only if no line of
+    play at all lets anyone win.
+
+reset_on_tie games are not solved: wiping tied boards makes positions repeat,
+so the game tree isn't finite.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from common import MARK_OF, UltimateBoard
+
+DEFAULT_BUDGET = 0.05  # seconds per call
+MEMO_SIZE = 500000  # entries; cleared wholesale when full
+
+_memo: Dict[Tuple, int] = {}
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _key(board: UltimateBoard, turn: int, players: int) -> bytes:
+    # players decides whose turn follows whose, so it is part of the position
+    head = f"{players}/{board.config.side}/{board.config.depth}/{board.win_rule}/{board.next_forced}/{turn}|".encode()
+    return head + bytes(board.cells) + bytes(board.grid_winners) + b"".join(board.level_winners)
+
+
+class Solver:
+    """
+    One solve() call. Every search method returns the exact answer, or None
+    when depth ran out before it could be proved; only exact answers are memoized.
+    """
+    def __init__(self, players: int, budget: float):
+        self.players = players
+        self.deadline = time.perf_counter() + budget
+        self.nodes = 0
+
+    def _tick(self):
+        # checked on every expanded node: expanding one copies up to a board's
+        # worth of children, which dwarfs the cost of reading the clock
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise _OutOfTime
+
+    def _children(self, board: UltimateBoard, turn: int) -> List[UltimateBoard]:
+        children = []
+        for move in board.legal_moves():
+            child = board.copy()
+            child.apply(turn, move)
+            children.append(child)
+        return children
+
+    def negamax(self, board: UltimateBoard, turn: int, depth: int) -> Optional[int]:
+        """2 players: +1 / 0 / -1 for the side to move."""
+        if board.macro_winner:
+            return 1 if board.macro_winner == turn else -1
+        if board.macro_tied:
+            return 0
+        key = ("n", _key(board, turn, self.players))
+        value = _memo.get(key)
+        if value is not None or depth == 0:
+            return value
+        self._tick()
+        children = self._children(board, turn)
+        if not children:
+            value = 0
+        elif any(c.macro_winner == turn for c in children):
+            value = 1
+        else:
+            value, unknown = -1, False
+            for child in children:
+                v = self.negamax(child, 3 - turn, depth - 1)
+                if v is None:
+                    unknown = True
+                elif -v > value:
+                    value = -v
+                    if value == 1:
+                        break
+            if unknown and value < 1:
+                return None
+        _memo[key] = value
+        return value
+
+    def forced_win(self, board: UltimateBoard, turn: int, player: int, depth: int) -> Optional[bool]:
+        """More players: can player win whatever the others do?"""
+        if board.macro_winner:
+            return board.macro_winner == player
+        if board.macro_tied:
+            return False
+        key = ("w", player, _key(board, turn, self.players))
+        value = _memo.get(key)
+        if value is not None or depth == 0:
+            return None if value is None else bool(value)
+        self._tick()
+        nxt = turn % self.players + 1
+        children = self._children(board, turn)
+        # player needs one winning move; against the others every reply must lose
+        want = turn == player
+        result: Optional[bool] = (not want) and bool(children)
+        for child in children:
+            v = self.forced_win(child, nxt, player, depth - 1)
+            if v is want:
+                result = want
+                break
+            if v is None:
+                result = None
+        if result is None:
+            return None
+        _memo[key] = int(result)
+        return result
+
+    def anyone_can_win(self, board: UltimateBoard, turn: int, depth: int) -> Optional[bool]:
+        if board.macro_winner:
+            return True
+        if board.macro_tied:
+            return False
+        key = ("a", _key(board, turn, self.players))
+        value = _memo.get(key)
+        if value is not None or depth == 0:
+            return None if value is None else bool(value)
+        self._tick()
+        nxt = turn % self.players + 1
+        result: Optional[bool] = False
+        for child in self._children(board, turn):
+            v = self.anyone_can_win(child, nxt, depth - 1)
+            if v:
+                result = True
+                break
+            if v is None:
+                result = None
+        if result is None:
+            return None
+        _memo[key] = int(result)
+        return result
+
+
+def solve(board: UltimateBoard, turn: int, players: int = 2, budget: float = DEFAULT_BUDGET
+          ) -> Optional[Dict]:
+    """
+    turn: player id to move. Returns {"result": "win", "winner": mark},
+    {"result": "draw"}, or None (not decided, or not provable within budget).
+    """
+    if board.reset_on_tie:
+        return None
+    if board.macro_winner:
+        return {"result": "win", "winner": MARK_OF[board.macro_winner]}
+    if board.macro_tied:
+        return {"result": "draw"}
+    if len(_memo) > MEMO_SIZE:
+        _memo.clear()
+
+    solver = Solver(players, budget)
+    # nobody plays more moves than there are empty cells
+    for depth in range(1, board.cells.count(0) + 1):
+        try:
+            if players == 2:
+                value = solver.negamax(board, turn, depth)
+                if value == 0:
+                    return {"result": "draw"}
+                if value is not None:
+                    return {"result": "win", "winner": MARK_OF[turn if value > 0 else 3 - turn]}
+                continue
+            for i in range(players):
+                player = (turn - 1 + i) % players + 1
+                if solver.forced_win(board, turn, player, depth):
+                    return {"result": "win", "winner": MARK_OF[player]}
+            if solver.anyone_can_win(board, turn, depth) is False:
+                return {"result": "draw"}
+        except _OutOfTime:
+            return None
+    return None
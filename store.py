@@ -0,0 +1,439 @@
+"""
+Accounts, game results and Elo ratings in a local SQLite file.
+
+    python server.py --db games.db
+    python store.py leaderboard games.db
+    python store.py player games.db alice
+
+Accounts: a client's {"type": "hello", "name": ..., "password": ...} logs in
+to the account of that name, creating it on first use. A password is optional;
+once an account has one, the name can't be used without it. Players without an
+account (no --db, or no name) play as guests and aren't rated.
+
+Writes never happen on the caller's thread: they are queued to one writer
+thread, which commits whatever has piled up (up to BATCH_MAX operations, or
+BATCH_WINDOW seconds after the first) in a single transaction. A finished game
+is one queued operation; the move that ended it doesn't wait for the disk.
+The only caller that waits is a login creating or claiming an account, since
+it needs the answer. A batch that can't be committed is rolled back and
+retried (COMMIT_RETRIES), then dropped with a message; waiting callers get a
+StoreError, as does anyone submitting after the writer thread has stopped.
+
+Ratings are Elo, updated by the writer when it stores a result, so they are
+always computed from the latest committed values: a win beats every other
+rated seat, a draw is a draw against every other rated seat.
+
+Reads (logins, leaderboards) use their own connection; the database is in WAL
+mode, so they don't wait for the writer either. Leaderboards are cached until
+this process writes a new result, or for LEADERBOARD_TTL seconds (several
+server processes can share one file, see shard.py).
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+START_RATING = 1200.0
+K_FACTOR = 32.0
+
+# writer batching
+BATCH_MAX = 256
+BATCH_WINDOW = 0.05  # seconds
+
+# a batch that can't be committed (e.g. "database is locked" while another
+# process holds the file) is rolled back and tried again this many times
+COMMIT_RETRIES = 3
+
+LEADERBOARD_TTL = 5.0
+HASH_ROUNDS = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+    password TEXT,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accounts_by_rating ON accounts (rating DESC);
+
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    seats INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    winner TEXT,
+    moves INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    mark TEXT NOT NULL,
+    account_id INTEGER REFERENCES accounts (id),
+    score REAL NOT NULL,
+    rating_before REAL,
+    rating_after REAL,
+    PRIMARY KEY (game_id, mark)
+);
+CREATE INDEX IF NOT EXISTS game_players_by_account ON game_players (account_id, game_id DESC);
+"""
+
+ACCOUNT_FIELDS = ("name", "rating", "games", "wins", "losses", "draws")
+
+
+# -----------------------------------------------------
+# ratings / passwords
+# -----------------------------------------------------
+def elo_updates(ratings: Dict[str, float], scores: Dict[str, float]) -> Dict[str, float]:
+    """
+    New ratings after one game. ratings/scores are keyed the same; a pair's
+    result is the difference of their scores (1 vs 0: a win, equal: a draw).
+    Each player's change is averaged over their opponents, so a 4-seat game
+    moves a rating about as much as a 2-seat one.
+    """
+    new = dict(ratings)
+    if len(ratings) < 2:
+        return new
+    for a, ra in ratings.items():
+        delta = 0.0
+        for b, rb in ratings.items():
+            if a == b:
+                continue
+            expected = 1.0 / (1.0 + 10 ** ((rb - ra) / 400.0))
+            actual = 0.5 + (scores[a] - scores[b]) / 2.0
+            delta += actual - expected
+        new[a] = ra + K_FACTOR * delta / (len(ratings) - 1)
+    return new
+
+
+def hash_password(password: str, salt: Optional[bytes] = None) -> str:
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, HASH_ROUNDS)
+    return f"pbkdf2${HASH_ROUNDS}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password: str, stored: str) -> bool:
+    try:
+        _, rounds, salt, digest = stored.split("$")
+        got = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), int(rounds))
+    except ValueError:
+        return False
+    return hmac.compare_digest(got.hex(), digest)
+
+
+# -----------------------------------------------------
+# writer
+# -----------------------------------------------------
+class StoreError(Exception):
+    """A write that didn't make it to disk, or a store whose writer has stopped."""
+
+
+class _Op:
+    """One queued write: fn(conn) runs inside the writer's transaction."""
+    def __init__(self, fn: Callable[[sqlite3.Connection], object], ratings: bool = False):
+        self.fn = fn
+        self.ratings = ratings  # changes the leaderboard
+        self.result = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class Store:
+    def __init__(self, path: str):
+        self.path = path
+        writer_conn = _connect(path)
+        writer_conn.executescript(SCHEMA)
+        self.reader = _connect(path)
+        self.read_lock = threading.Lock()
+
+        self.queue: "queue.Queue[Optional[_Op]]" = queue.Queue()
+        # bumped by the writer whenever ratings change; leaderboard cache entries
+        # remember the generation they were read at
+        self.generation = 0
+        self.leaderboards: Dict[Tuple[int, int], Tuple[int, float, List[Dict]]] = {}
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0  # writes given up on
+        self.running = True
+        self.writer = threading.Thread(target=self._write_loop, args=(writer_conn,),
+                                       name="store-writer", daemon=True)
+        self.writer.start()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], object], wait: bool = False,
+               ratings: bool = False):
+        """
+        Queue a write; with wait=True block until it is committed and return fn's
+        result. Raises StoreError if the writer has stopped, or (wait=True) if
+        the write failed.
+        """
+        if not self.running:
+            raise StoreError(f"{self.path}: writer is not running")
+        op = _Op(fn, ratings)
+        self.queue.put(op)
+        if wait:
+            # the writer may have stopped after the check above, before taking op
+            while not op.done.wait(1.0):
+                if not self.writer.is_alive():
+                    raise StoreError(f"{self.path}: writer is not running")
+            if op.error is not None:
+                raise StoreError(f"{self.path}: write failed: {op.error!r}")
+            return op.result
+        return None
+
+    def _write_loop(self, conn: sqlite3.Connection):
+        stopping = False
+        try:
+            while not stopping:
+                op = self.queue.get()
+                if op is None:
+                    break
+                batch = [op]
+                deadline = time.monotonic() + BATCH_WINDOW
+                while len(batch) < BATCH_MAX:
+                    try:
+                        op = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if op is None:
+                        stopping = True
+                        break
+                    batch.append(op)
+                try:
+                    self._commit(conn, batch)
+                finally:
+                    # nobody waits forever on a batch, whatever happened to it
+                    for op in batch:
+                        op.done.set()
+        except Exception as e:
+            print(f"[STORE] writer stopped: {e!r}")
+        finally:
+            self.running = False
+            # fail whatever was queued after the writer stopped
+            while True:
+                try:
+                    op = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is not None:
+                    op.error = StoreError("writer stopped")
+                    op.done.set()
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[_Op]):
+        """Commit batch as one transaction, retrying it as a whole if that fails."""
+        for attempt in range(1, COMMIT_RETRIES + 1):
+            try:
+                self._run_batch(conn, batch)
+                break
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                if attempt == COMMIT_RETRIES:
+                    print(f"[STORE] dropped {len(batch)} writes after {attempt} tries: {e!r}")
+                    self.failed += len(batch)
+                    for op in batch:
+                        op.error = e
+                    return
+                time.sleep(0.1 * attempt)
+        self.batches += 1
+        self.writes += len(batch)
+        if any(op.ratings and op.error is None for op in batch):
+            self.generation += 1
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: List[_Op]):
+        conn.execute("BEGIN IMMEDIATE")
+        for op in batch:
+            op.result, op.error = None, None
+            # a savepoint per operation: one bad write doesn't lose the rest of the batch
+            conn.execute("SAVEPOINT op")
+            try:
+                op.result = op.fn(conn)
+            except Exception as e:
+                print(f"[STORE] write failed: {e!r}")
+                op.error = e
+                self.failed += 1
+                conn.execute("ROLLBACK TO op")
+            conn.execute("RELEASE op")
+        conn.execute("COMMIT")
+
+    def flush(self):
+        """Wait until everything queued so far is committed."""
+        self.submit(lambda conn: None, wait=True)
+
+    def close(self):
+        if self.running:
+            self.queue.put(None)
+        self.writer.join()
+        with self.read_lock:
+            self.reader.close()
+
+    def _read(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self.read_lock:
+            try:
+                return self.reader.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                raise StoreError(f"{self.path}: read failed: {e!r}") from e
+
+    # --------------------------------------------------
+    # accounts
+    # --------------------------------------------------
+    def login(self, name: str, password: Optional[str] = None) -> Optional[Dict]:
+        """
+        The account called name (created if new), or None if it has a password
+        and this isn't it. A password given for an account without one claims it.
+        """
+        rows = self._read("SELECT * FROM accounts WHERE name = ?", (name,))
+        row = rows[0] if rows else None
+        if row is not None and row["password"]:
+            if not password or not check_password(password, row["password"]):
+                return None
+            self.submit(lambda conn: conn.execute(
+                "UPDATE accounts SET last_seen = ? WHERE id = ?", (time.time(), row["id"])))
+            return {k: row[k] for k in ACCOUNT_FIELDS}
+        if row is not None and not password:
+            self.submit(lambda conn: conn.execute(
+                "UPDATE accounts SET last_seen = ? WHERE id = ?", (time.time(), row["id"])))
+            return {k: row[k] for k in ACCOUNT_FIELDS}
+        # new account, or claiming one: hash here, not on the writer thread
+        hashed = hash_password(password) if password else None
+        return self.submit(lambda conn: self._claim(conn, name, hashed), wait=True)
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, name: str, hashed: Optional[str]) -> Optional[Dict]:
+        now = time.time()
+        conn.execute("INSERT OR IGNORE INTO accounts (name, password, rating, created, last_seen) "
+                     "VALUES (?, ?, ?, ?, ?)", (name, hashed, START_RATING, now, now))
+        if hashed:
+            # somebody may have set a password since our read; theirs wins
+            conn.execute("UPDATE accounts SET password = ? WHERE name = ? AND password IS NULL",
+                         (hashed, name))
+        row = conn.execute("SELECT * FROM accounts WHERE name = ?", (name,)).fetchone()
+        if row["password"] != hashed:
+            return None
+        return {k: row[k] for k in ACCOUNT_FIELDS}
+
+    def player(self, name: str, games: int = 10) -> Optional[Dict]:
+        """An account and its latest games."""
+        rows = self._read("SELECT * FROM accounts WHERE name = ?", (name,))
+        if not rows:
+            return None
+        account = {k: rows[0][k] for k in ACCOUNT_FIELDS}
+        account["recent"] = [dict(r) for r in self._read(
+            "SELECT g.id, g.finished, g.result, g.winner, p.mark, p.score, p.rating_before, p.rating_after "
+            "FROM game_players p JOIN games g ON g.id = p.game_id "
+            "WHERE p.account_id = ? ORDER BY p.game_id DESC LIMIT ?", (rows[0]["id"], games))]
+        return account
+
+    # --------------------------------------------------
+    # results
+    # --------------------------------------------------
+    def record_game(self, seats: Dict[str, Optional[str]], winner: Optional[str], moves: int):
+        """
+        Queue a finished game. seats: mark -> account name (None for guests),
+        winner: the winning mark, None for a draw. Returns at once.
+        """
+        self.submit(lambda conn: self._record(conn, dict(seats), winner, moves), ratings=True)
+
+    @staticmethod
+    def _record(conn: sqlite3.Connection, seats: Dict[str, Optional[str]], winner: Optional[str],
+                moves: int):
+        cur = conn.execute("INSERT INTO games (finished, seats, result, winner, moves) VALUES (?, ?, ?, ?, ?)",
+                           (time.time(), len(seats), "win" if winner else "draw", winner, moves))
+        game_id = cur.lastrowid
+
+        scores = {mark: (1.0 if mark == winner else 0.0) if winner else 0.5 for mark in seats}
+        # rated: one seat per account (the same account twice in a game isn't rated)
+        accounts: Dict[str, sqlite3.Row] = {}
+        for mark, name in seats.items():
+            if name is None:
+                continue
+            row = conn.execute("SELECT id, rating FROM accounts WHERE name = ?", (name,)).fetchone()
+            if row is not None and row["id"] not in {r["id"] for r in accounts.values()}:
+                accounts[mark] = row
+        before = {mark: row["rating"] for mark, row in accounts.items()}
+        after = elo_updates(before, {mark: scores[mark] for mark in accounts})
+
+        for mark in seats:
+            row = accounts.get(mark)
+            conn.execute("INSERT INTO game_players (game_id, mark, account_id, score, rating_before, rating_after) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (game_id, mark, row["id"] if row else None, scores[mark],
+                          before.get(mark), after.get(mark)))
+            if row is None or len(accounts) < 2:
+                continue
+            outcome = "draws" if not winner else "wins" if mark == winner else "losses"
+            conn.execute(f"UPDATE accounts SET rating = ?, games = games + 1, {outcome} = {outcome} + 1 "
+                         "WHERE id = ?", (after[mark], row["id"]))
+        return game_id
+
+    # --------------------------------------------------
+    # leaderboard
+    # --------------------------------------------------
+    def leaderboard(self, limit: int = 10, min_games: int = 1) -> List[Dict]:
+        """Top accounts by rating (served from cache when nothing changed)."""
+        key = (limit, min_games)
+        cached = self.leaderboards.get(key)
+        now = time.monotonic()
+        if cached is not None and cached[0] == self.generation and now - cached[1] < LEADERBOARD_TTL:
+            return cached[2]
+        generation = self.generation
+        rows = [{k: r[k] for k in ACCOUNT_FIELDS} for r in self._read(
+            "SELECT * FROM accounts WHERE games >= ? ORDER BY rating DESC LIMIT ?", (min_games, limit))]
+        self.leaderboards[key] = (generation, now, rows)
+        return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    p = argparse.ArgumentParser(description="Look at the accounts and ratings database")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    lb = sub.add_parser("leaderboard", help="top rated accounts")
+    lb.add_argument("path")
+    lb.add_argument("--limit", type=int, default=20)
+    lb.add_argument("--min-games", type=int, default=1)
+    pl = sub.add_parser("player", help="one account and its latest games")
+    pl.add_argument("path")
+    pl.add_argument("name")
+    args = p.parse_args(argv)
+
+    store = Store(args.path)
+    try:
+        if args.cmd == "leaderboard":
+            for i, row in enumerate(store.leaderboard(args.limit, args.min_games), 1):
+                print(f"  {i:>3}. {row['name']:<32} {row['rating']:7.1f}  "
+                      f"{row['wins']}W {row['losses']}L {row['draws']}D")
+        else:
+            account = store.player(args.name)
+            if account is None:
+                raise SystemExit(f"no account called {args.name!r}")
+            recent = account.pop("recent")
+            for key, value in account.items():
+                print(f"  {key:<8} {value}")
+            for g in recent:
+                change = "" if g["rating_after"] is None else f"{g['rating_after'] - g['rating_before']:+.1f}"
+                print(f"  game {g['id']}: {g['mark']} {g['result']} (winner {g['winner']}) {change}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+One hierarchical timer wheel for the whole server.
+
+Every room's turn clock, every connection's idle timeout and every coalesced
+broadcast is a Timer on the same TimerWheel, driven by a single thread. That
+keeps us at one thread no matter how many rooms are open, instead of one
+threading.Timer (= one thread) per clock.
+
+Layout: `levels` wheels of `slots` buckets each. Level 0 buckets are one tick
+wide, level 1 buckets are `slots` ticks wide, and so on. A timer goes into the
+coarsest level it fits, and is moved ("cascaded") one level down each time the
+finer wheel wraps around to its bucket. Buckets are dicts used as ordered sets,
+so schedule() and cancel() are O(1); advance() is O(1) per tick plus O(levels)
+moves per timer over its lifetime.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class Timer:
+    __slots__ = ("expires", "callback", "args", "bucket")
+
+    def __init__(self, expires: int, callback: Callable, args: tuple):
+        self.expires = expires  # absolute tick
+        self.callback = callback
+        self.args = args
+        self.bucket: Optional[Dict["Timer", None]] = None
+
+    @property
+    def active(self) -> bool:
+        return self.bucket is not None
+
+
+class TimerWheel:
+    """
+    tick:   seconds per level-0 slot (timers fire up to one tick late, never early)
+    slots:  buckets per level (power of two)
+    levels: number of wheels; delays beyond tick * slots**levels are clamped
+    """
+    def __init__(self, tick: float = 0.01, slots: int = 256, levels: int = 4):
+        assert slots & (slots - 1) == 0, "slots must be a power of two"
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.wheels: List[List[Dict[Timer, None]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.max_ticks = slots ** levels - 1
+
+        self.start_time = time.monotonic()
+        self.now_tick = 0
+        self.lock = threading.Lock()
+        self.count = 0  # live timers
+        self.running = False
+        self._thread: Optional[threading.Thread] = None
+
+    # --------------------------------------------------
+    # internals (call with lock held)
+    # --------------------------------------------------
+    def _insert(self, timer: Timer):
+        diff = timer.expires - self.now_tick
+        if diff < 0:
+            diff = 0
+        if diff > self.max_ticks:
+            diff = self.max_ticks
+            timer.expires = self.now_tick + diff
+        level = 0
+        while diff >= self.slots ** (level + 1):
+            level += 1
+        bucket = self.wheels[level][(timer.expires >> (self.bits * level)) & self.mask]
+        bucket[timer] = None
+        timer.bucket = bucket
+
+    def _cascade(self, level: int):
+        """Move the bucket the level-`level` wheel just reached down into finer wheels."""
+        idx = (self.now_tick >> (self.bits * level)) & self.mask
+        bucket = self.wheels[level][idx]
+        if not bucket:
+            return
+        self.wheels[level][idx] = {}
+        for timer in bucket:
+            self._insert(timer)
+
+    def _step(self) -> List[Timer]:
+        """Advance one tick; return the timers that are due."""
+        self.now_tick += 1
+        level = 0
+        # a finer wheel wrapping to 0 pulls in the next bucket from the level above
+        while level + 1 < self.levels and (self.now_tick >> (self.bits * level)) & self.mask == 0:
+            level += 1
+            self._cascade(level)
+        idx = self.now_tick & self.mask
+        due = self.wheels[0][idx]
+        if not due:
+            return []
+        self.wheels[0][idx] = {}
+        for timer in due:
+            timer.bucket = None
+        self.count -= len(due)
+        return list(due)
+
+    # --------------------------------------------------
+    # public API
+    # --------------------------------------------------
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """Call callback(*args) from the wheel thread after delay seconds. O(1)."""
+        with self.lock:
+            ticks = max(1, int(-(-delay // self.tick)))  # ceil, and never "now"
+            timer = Timer(self.now_tick + ticks, callback, args)
+            self._insert(timer)
+            self.count += 1
+        return timer
+
+    def cancel(self, timer: Optional[Timer]) -> bool:
+        """Stop a timer if it hasn't fired yet. O(1). Returns True if it was pending."""
+        if timer is None:
+            return False
+        with self.lock:
+            if timer.bucket is None:
+                return False
+            del timer.bucket[timer]
+            timer.bucket = None
+            self.count -= 1
+            return True
+
+    def advance(self, now: Optional[float] = None):
+        """Fire everything due up to monotonic time now (default: the real clock)."""
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.start_time) / self.tick)
+        while True:
+            with self.lock:
+                if self.now_tick >= target:
+                    return
+                due = self._step()
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:  # one bad callback must not stop every clock
+                    print(f"[TIMERS] callback {timer.callback!r} failed: {e!r}")
+
+    def run(self):
+        self.running = True
+        while self.running:
+            time.sleep(self.tick)
+            self.advance()
+
+    def start(self) -> "TimerWheel":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="timer-wheel", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+
+def off_wheel(fn: Callable, *args):
+    """
+    Run fn(*args) on a thread of its own. Schedule callbacks that take locks or
+    touch sockets through this (wheel.schedule(delay, off_wheel, fn, ...)): the
+    wheel thread is shared, so it should only hand out work, never wait on it.
+    """
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+
+_shared: Optional[TimerWheel] = None
+_shared_lock = threading.Lock()
+
+
+def shared_wheel() -> TimerWheel:
+    """The process-wide wheel (started on first use) that all rooms share."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TimerWheel().start()
+        return _shared
@@ -0,0 +1,451 @@
+"""
+WebSocket gateway: browsers join the same GameServer rooms as the pygame client.
+
+    python server.py --ws-port 8766
+
+Browsers connect to ws://host:8766/ (or /<room>) and then speak exactly the
+TCP protocol, one JSON message per WebSocket text message: "assign", "state",
+"error", "shutdown" from us; "hello", "move", "ping", "shutdown" from them.
+
+There is no proxying: each WebSocket is wrapped in a WebSocketConnection,
+which looks enough like a socket (recv / sendall / shutdown / close) to be
+handed straight to GameServer.join. A room can mix TCP and WebSocket players.
+
+permessage-deflate (RFC 7692) is negotiated with no context takeover in
+either direction, so every message is compressed on its own. That is what
+makes it possible to build a broadcast's frame once (GameServer encodes the
+state once and hands the same bytes to every subscriber) and send those
+exact frame bytes to every WebSocket in the room, see FrameCache.
+
+WebSocketClient at the bottom is a small stand-in client for local testing:
+
+    python ws_gateway.py probe 127.0.0.1 8766 [room]
+"""
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from server import MAX_LINE, GameServer
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_PORT = 8766
+MAX_HANDSHAKE = 8 * 1024
+# below this, deflate costs more than it saves
+DEFLATE_MIN = 64
+
+# opcodes
+CONT, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+
+
+class HandshakeError(Exception):
+    pass
+
+
+# -----------------------------------------------------
+# framing
+# -----------------------------------------------------
+def deflate(payload: bytes) -> bytes:
+    c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    data = c.compress(payload) + c.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4] if data.endswith(DEFLATE_TAIL) else data
+
+
+def inflate(payload: bytes, limit: int) -> bytes:
+    d = zlib.decompressobj(-15)
+    data = d.decompress(payload + DEFLATE_TAIL, limit + 1)
+    if len(data) > limit:
+        raise ValueError("message too big")
+    return data
+
+
+def encode_frame(opcode: int, payload: bytes, compress: bool = False, mask: bool = False) -> bytes:
+    """One unfragmented frame. Servers never mask; clients always do."""
+    first = 0x80 | opcode
+    if compress and len(payload) >= DEFLATE_MIN:
+        payload = deflate(payload)
+        first |= 0x40  # RSV1: compressed
+    n = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if n < 126:
+        head = struct.pack("!BB", first, mask_bit | n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", first, mask_bit | 126, n)
+    else:
+        head = struct.pack("!BBQ", first, mask_bit | 127, n)
+    if mask:
+        key = os.urandom(4)
+        payload = _apply_mask(payload, key)
+        head += key
+    return head + payload
+
+
+def _apply_mask(payload: bytes, key: bytes) -> bytes:
+    # xor with the key repeated over the payload, as one big int operation
+    n = len(payload)
+    if not n:
+        return payload
+    keys = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(keys, "big")).to_bytes(n, "big")
+
+
+class FrameReader:
+    """Reads whole messages (reassembling fragments, answering pings) from a socket."""
+    def __init__(self, sock: socket.socket, deflate_ok: bool, limit: int, on_control: Callable):
+        self.sock = sock
+        self.deflate_ok = deflate_ok
+        self.limit = limit
+        self.on_control = on_control
+        self.buf = b""
+
+    def _read(self, n: int) -> bytes:
+        while len(self.buf) < n:
+            chunk = self.sock.recv(max(4096, n - len(self.buf)))
+            if not chunk:
+                raise ConnectionError("closed")
+            self.buf += chunk
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def _frame(self) -> Tuple[bool, int, bool, bytes]:
+        b0, b1 = self._read(2)
+        fin, rsv1, opcode = bool(b0 & 0x80), bool(b0 & 0x40), b0 & 0x0F
+        n = b1 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", self._read(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", self._read(8))[0]
+        if n > self.limit:
+            raise ValueError("frame too big")
+        key = self._read(4) if b1 & 0x80 else b""
+        payload = self._read(n)
+        if key:
+            payload = _apply_mask(payload, key)
+        return fin, opcode, rsv1, payload
+
+    def message(self) -> Optional[Tuple[int, bytes]]:
+        """(opcode, payload) of the next data message, or None once the peer closes."""
+        parts, opcode, compressed, size = [], None, False, 0
+        while True:
+            fin, op, rsv1, payload = self._frame()
+            if op >= CLOSE:  # control frames can arrive between fragments
+                if op == CLOSE:
+                    self.on_control(CLOSE, payload[:2])
+                    return None
+                if op == PING:
+                    self.on_control(PONG, payload)
+                continue
+            if op != CONT:
+                opcode, compressed = op, rsv1 and self.deflate_ok
+            elif opcode is None:
+                raise ValueError("continuation without a message")
+            parts.append(payload)
+            size += len(payload)
+            if size > self.limit:
+                raise ValueError("message too big")
+            if fin:
+                data = b"".join(parts)
+                return opcode, inflate(data, self.limit) if compressed else data
+
+
+# -----------------------------------------------------
+# server side
+# -----------------------------------------------------
+def _headers(request: bytes) -> Tuple[str, Dict[str, str]]:
+    lines = request.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) < 3 or parts[0] != "GET":
+        raise HandshakeError("not a GET request")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return parts[1], headers
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def handshake(sock: socket.socket) -> Tuple[str, bool, bytes]:
+    """Server half of the opening handshake. Returns (path, deflate negotiated, leftover bytes)."""
+    buf = b""
+    while b"\r\n\r\n" not in buf:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise HandshakeError("closed during handshake")
+        buf += chunk
+        if len(buf) > MAX_HANDSHAKE:
+            raise HandshakeError("handshake too big")
+    request, _, rest = buf.partition(b"\r\n\r\n")
+    path, headers = _headers(request)
+    key = headers.get("sec-websocket-key")
+    if headers.get("upgrade", "").lower() != "websocket" or not key:
+        sock.sendall(b"HTTP/1.1 426 Upgrade Required\r\nSec-WebSocket-Version: 13\r\n\r\n")
+        raise HandshakeError("not a websocket upgrade")
+    offers = [o.split(";")[0].strip() for o in headers.get("sec-websocket-extensions", "").split(",")]
+    use_deflate = "permessage-deflate" in offers
+    response = [
+        "HTTP/1.1 101 Switching Protocols",
+        "Upgrade: websocket",
+        "Connection: Upgrade",
+        f"Sec-WebSocket-Accept: {accept_key(key)}",
+    ]
+    if use_deflate:
+        response.append("Sec-WebSocket-Extensions: permessage-deflate; "
+                        "server_no_context_takeover; client_no_context_takeover")
+    sock.sendall(("\r\n".join(response) + "\r\n\r\n").encode("ascii"))
+    return path, use_deflate, rest
+
+
+# what GameServer's "state" broadcasts start with (encode() of a dict whose first key is "type")
+STATE_PREFIX = b'{"type": "state"'
+
+
+class FrameCache:
+    """
+    Frames of the last state broadcast sent through any WebSocket of one room.
+    broadcast_state passes the same bytes object to every subscriber, so the
+    first WebSocket builds (and compresses) the frame and the rest reuse it.
+    Only states come through here: a message for one connection (an "assign",
+    an error) would evict the broadcast's frames and gain nothing.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data: Optional[bytes] = None
+        self.frames: Dict[bool, bytes] = {}
+        self.built = 0
+        self.reused = 0
+
+    def frame(self, data: bytes, compress: bool) -> bytes:
+        with self.lock:
+            if data is not self.data:
+                self.data = data
+                self.frames = {}
+            frame = self.frames.get(compress)
+            if frame is None:
+                frame = self.frames[compress] = encode_frame(TEXT, data.rstrip(b"\n"), compress)
+                self.built += 1
+            else:
+                self.reused += 1
+            return frame
+
+
+class WebSocketConnection:
+    """
+    A WebSocket dressed up as the socket GameServer expects: recv() returns
+    each incoming text message as a newline-terminated line, sendall() turns
+    each outgoing line into one text message.
+    """
+    def __init__(self, sock: socket.socket, deflate_ok: bool, frames: FrameCache, leftover: bytes = b""):
+        self.sock = sock
+        self.deflate_ok = deflate_ok
+        self.frames = frames
+        self.send_lock = threading.Lock()
+        self.reader = FrameReader(sock, deflate_ok, MAX_LINE, self._control)
+        self.reader.buf = leftover
+        self.close_sent = False
+
+    def _control(self, opcode: int, payload: bytes):
+        try:
+            if opcode == CLOSE:
+                self._send_close(payload)
+            else:
+                self._send_frame(encode_frame(opcode, payload))
+        except OSError:
+            pass
+
+    def _send_close(self, payload: bytes):
+        """Our close frame: one per connection, whoever started the close; nothing follows it."""
+        with self.send_lock:
+            if self.close_sent:
+                return
+            self.close_sent = True
+            self.sock.sendall(encode_frame(CLOSE, payload))
+
+    def _send_frame(self, frame: bytes):
+        with self.send_lock:
+            if self.close_sent:
+                raise BrokenPipeError("WebSocket is closing")
+            self.sock.sendall(frame)
+
+    def recv(self, n: int) -> bytes:
+        try:
+            while True:
+                msg = self.reader.message()
+                if msg is None:
+                    return b""
+                opcode, data = msg
+                if opcode == TEXT:
+                    return data.replace(b"\n", b" ") + b"\n"
+                # binary messages aren't part of the protocol
+        except (ConnectionError, ValueError, zlib.error):
+            return b""
+
+    def sendall(self, data: bytes):
+        if data.startswith(STATE_PREFIX):
+            frame = self.frames.frame(data, self.deflate_ok)
+        else:
+            frame = encode_frame(TEXT, data.rstrip(b"\n"), self.deflate_ok)
+        self._send_frame(frame)
+
+    def shutdown(self, how: int):
+        self.sock.shutdown(how)
+
+    def setsockopt(self, *args):
+        self.sock.setsockopt(*args)
+
+    def close(self):
+        try:
+            self._send_close(struct.pack("!H", 1000))
+        except OSError:
+            pass
+        self.sock.close()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+
+class WebSocketGateway:
+    """
+    room_for: room code (URL path without the leading "/") -> GameServer.
+    With a plain single-room server that is just `lambda code: gs`.
+    """
+    def __init__(self, room_for: Callable[[str], GameServer]):
+        self.room_for = room_for
+        self.frame_caches: Dict[int, FrameCache] = {}  # id(GameServer) -> cache
+        self.lock = threading.Lock()
+        self.running = True
+
+    def frames_for(self, gs) -> FrameCache:
+        with self.lock:
+            cache = self.frame_caches.get(id(gs))
+            if cache is None:
+                cache = self.frame_caches[id(gs)] = FrameCache()
+            return cache
+
+    def attach(self, sock: socket.socket, addr):
+        try:
+            sock.settimeout(10.0)
+            path, use_deflate, leftover = handshake(sock)
+            sock.settimeout(None)
+        except (HandshakeError, OSError) as e:
+            print(f"[WS] {addr}: {e}")
+            sock.close()
+            return
+        room = path.split("?")[0].strip("/")
+        gs = self.room_for(room)
+        conn = WebSocketConnection(sock, use_deflate, self.frames_for(gs), leftover)
+        print(f"[WS] {addr} joined room {room!r}{' (deflate)' if use_deflate else ''}")
+        gs.join(conn)
+
+    def accept_loop(self, server_sock: socket.socket):
+        while self.running:
+            try:
+                client, addr = server_sock.accept()
+            except OSError:
+                break
+            # the handshake can be slow (or never finish); don't hold up accept for it
+            threading.Thread(target=self.attach, args=(client, addr), daemon=True).start()
+
+    def run(self, host: str = "0.0.0.0", port: int = WS_PORT):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(64)
+            host, port = server.getsockname()[:2]
+            print(f"[WS] Listening on {host}:{port}", flush=True)
+            self.accept_loop(server)
+
+    def start(self, host: str = "0.0.0.0", port: int = WS_PORT) -> threading.Thread:
+        t = threading.Thread(target=self.run, args=(host, port), daemon=True)
+        t.start()
+        return t
+
+
+# -----------------------------------------------------
+# stand-in client (local testing)
+# -----------------------------------------------------
+class WebSocketClient:
+    """Minimal browser stand-in: masked frames, optional permessage-deflate."""
+    def __init__(self, host: str, port: int = WS_PORT, room: str = "", use_deflate: bool = True):
+        self.sock = socket.create_connection((host, port))
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        request = [
+            f"GET /{room} HTTP/1.1",
+            f"Host: {host}:{port}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key}",
+            "Sec-WebSocket-Version: 13",
+        ]
+        if use_deflate:
+            request.append("Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits")
+        self.sock.sendall(("\r\n".join(request) + "\r\n\r\n").encode("ascii"))
+
+        buf = b""
+        while b"\r\n\r\n" not in buf:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise HandshakeError("closed during handshake")
+            buf += chunk
+        response, _, rest = buf.partition(b"\r\n\r\n")
+        lines = response.decode("latin-1").split("\r\n")
+        if lines[0].split(" ")[1:2] != ["101"]:
+            raise HandshakeError(lines[0])
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:])}
+        if headers.get("sec-websocket-accept") != accept_key(key):
+            raise HandshakeError("bad Sec-WebSocket-Accept")
+        self.deflate = "permessage-deflate" in headers.get("sec-websocket-extensions", "")
+        self.reader = FrameReader(self.sock, self.deflate, 1 << 24, self._control)
+        self.reader.buf = rest
+
+    def _control(self, opcode: int, payload: bytes):
+        self.sock.sendall(encode_frame(opcode, payload, mask=True))
+
+    def send(self, payload: Dict):
+        self.sock.sendall(encode_frame(TEXT, json.dumps(payload).encode("utf-8"), self.deflate, mask=True))
+
+    def recv(self) -> Optional[Dict]:
+        try:
+            msg = self.reader.message()
+        except (ConnectionError, OSError):
+            return None
+        if msg is None:
+            return None
+        return json.loads(msg[1])
+
+    def close(self):
+        try:
+            self.sock.sendall(encode_frame(CLOSE, struct.pack("!H", 1000), mask=True))
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def main(argv):
+    if len(argv) < 3 or argv[0] != "probe":
+        print("usage: python ws_gateway.py probe HOST PORT [ROOM]")
+        return
+    client = WebSocketClient(argv[1], int(argv[2]), argv[3] if len(argv) > 3 else "")
+    client.send({"type": "hello", "name": "probe"})
+    print(f"[WS] connected (deflate={client.deflate})")
+    for _ in range(2):
+        msg = client.recv()
+        if msg is None:
+            break
+        print(json.dumps(msg)[:200])
+    client.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])